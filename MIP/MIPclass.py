@@ -3,18 +3,116 @@ import numpy as np
 import math
 import json
 import os
+import hashlib
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pulp import LpProblem, LpMinimize, LpVariable, LpBinary, lpSum, PULP_CBC_CMD, GLPK_CMD, LpStatus, LpInteger
+from pulp import LpProblem, LpMinimize, LpVariable, LpBinary, lpSum, PULP_CBC_CMD, GLPK_CMD, LpStatus, LpInteger, LpStatusOptimal, LpStatusNotSolved, LpSolutionOptimal, LpSolutionIntegerFeasible, LpSolutionInfeasible, LpSolutionUnbounded, LpSolutionNoSolutionFound
+from MIP.sparse import admissible_arcs, column_layout, constraint_matrix, write_mps
+from SAT.heuristic import greedy_routing, symmetric_pairs
+from SAT.files import atomic_path
+
+# Solver parameter presets. Parameters given explicitly to MIP_solver override the preset values.
+# On inst07 with CBC, forcing every cut generator or disabling strong branching was slower than the
+# defaults, fewer strong branching candidates with more presolve was slightly faster
+MIP_PRESETS = {
+    'default': {},
+    'light': {'strong_branching': 5, 'presolve': 'more'},
+    'gap': {'gap_rel': 0.01}
+}
+
+def cbc_options(options):
+    """
+    CBC command line arguments for the solver parameters
+    """
+    args = []
+    if options.get('threads') is not None:
+        args += ['-threads', str(options['threads'])]
+    if options.get('cuts') is not None:
+        args += ['-cuts', options['cuts']]
+    if options.get('presolve') is not None:
+        args += ['-presolve', options['presolve']]
+    if options.get('strong_branching') is not None:
+        args += ['-strongBranching', str(options['strong_branching'])]
+    if options.get('fpump') is not None:
+        args += ['-feasibilityPump', 'on' if options['fpump'] else 'off']
+    if options.get('gap_rel') is not None:
+        args += ['-ratioGap', str(options['gap_rel'])]
+    if options.get('gap_abs') is not None:
+        args += ['-allowableGap', str(options['gap_abs'])]
+    return args
+
+def glpk_options(options):
+    """
+    Closest glpsol arguments for the solver parameters. GLPK is single-threaded, only has all cuts on or off,
+    has no absolute gap, and its nearest match to strong branching is hybrid pseudocost branching
+    """
+    args = []
+    if options.get('cuts') not in (None, 'off'):
+        args.append('--cuts')
+    if options.get('presolve') not in (None, 'off'):
+        args.append('--intopt')
+    if options.get('strong_branching'):
+        args.append('--pcost')
+    if options.get('fpump'):
+        args.append('--fpump')
+    if options.get('gap_rel') is not None:
+        args += ['--mipgap', str(options['gap_rel'])]
+    return args
+
+# Solution status of each glpsol result status. GLPK_CMD.readsol maps the non-optimal integer
+# solutions of a time limited run to the same problem status as the optimal ones
+GLPK_SOLUTION_STATUS = {
+    'INTEGER OPTIMAL': LpSolutionOptimal,
+    'OPTIMAL': LpSolutionOptimal,
+    'INTEGER NON-OPTIMAL': LpSolutionIntegerFeasible,
+    'INFEASIBLE (FINAL)': LpSolutionInfeasible,
+    'INTEGER EMPTY': LpSolutionInfeasible,
+    'UNBOUNDED': LpSolutionUnbounded
+}
+
+def glpk_solution_status(out_file):
+    """
+    PuLP solution status of a glpsol output file, read from the same line as GLPK_CMD.readsol
+    """
+    with open(out_file) as f:
+        for _ in range(4):
+            f.readline()
+        status = f.readline()[12:-1]
+    return GLPK_SOLUTION_STATUS.get(status, LpSolutionNoSolutionFound)
+
+def write_start(path, variables, values):
+    """
+    Writes variable values as a CBC solution file, in the format of PULP_CBC_CMD.writesol, for -mips
+    """
+    with open(path, 'w') as f:
+        f.write("Stopped on time - objective value 0\n")
+        f.writelines("{:>7} {} {:>15} {:>23}\n".format(idx, var.name, values.get(var.name) or 0, 0) for idx, var in enumerate(variables))
 
 class MIP_solver:
-    def __init__(self, instance_number, timelimit=300, save_directory='res/MIP', verbosity='s', solver_name='CBC', variation=0):
+    def __init__(self, instance_number, timelimit=300, save_directory='res/MIP', verbosity='s', solver_name='CBC', variation=0, builder='pulp', cache_directory=None, workers=None, preset='default', threads=None, cuts=None, presolve=None, strong_branching=None, fpump=None, gap_rel=None, gap_abs=None, warm_start=False, neighbours=None, symmetry_breaking=False):
         """   
         :param instance_number: Number of the instance to solve.
         :param timelimit: Time limit for the solver.
         :param save_directory: Directory to save the results.
         :param verbosity: Print minimal or full output information (s or v).
         :param solver_name: Name of the solver to use ('CBC', 'GLPK', or 'ALL').
-        :param variation: Which variation of MTZ constraints to use (0 or 1).
+        :param variation: Which variation of MTZ constraints to use (0 or 1), or 2 for lazy subtour elimination cuts.
+        :param builder: How the model is built: 'pulp' with lpSum expressions, or 'sparse' as a NumPy constraint matrix written to MPS.
+        :param cache_directory: Directory where the MPS file of each model is kept and reused by later runs (None for a temporary directory).
+        :param workers: How many solver and variation combinations run at the same time (None for the number of cores).
+        :param preset: Name of the MIP_PRESETS entry the solver parameters start from.
+        :param threads: CBC threads of each run (None to split the cores between the concurrent runs).
+        :param cuts: CBC cut generator level ('off', 'root', 'ifmove', 'on' or 'forceOn'), any level but 'off' turns on all GLPK cuts.
+        :param presolve: CBC presolve ('off', 'on' or 'more'), GLPK uses its MIP presolver unless 'off'.
+        :param strong_branching: Number of CBC strong branching candidates, GLPK uses pseudocost branching if positive.
+        :param fpump: Whether the feasibility pump heuristic runs.
+        :param gap_rel: Relative gap at which the search stops.
+        :param gap_abs: Absolute gap at which CBC stops.
+        :param warm_start: Start CBC from a greedy heuristic solution, also returned when no solver finds one in time.
+        :param neighbours: Only create the arcs between each node and its this many nearest nodes, besides the greedy routes (None for every capacity-feasible arc).
+        :param symmetry_breaking: Order interchangeable couriers by their first item.
         """
         instances_folder = Path.cwd() / 'instances'
         filename = f'inst{instance_number:02d}.dat'
@@ -27,6 +125,16 @@ class MIP_solver:
         self.verbosity = 1 if verbosity == 'v' else 0
         self.solver_name = solver_name
         self.variation = variation
+        self.builder = builder
+        self.cache_directory = cache_directory
+        self.workers = workers or os.cpu_count() or 1
+        self.preset = preset
+        explicit = {'threads': threads, 'cuts': cuts, 'presolve': presolve, 'strong_branching': strong_branching,
+                    'fpump': fpump, 'gap_rel': gap_rel, 'gap_abs': gap_abs}
+        self.options = dict(MIP_PRESETS[preset], **{name: value for name, value in explicit.items() if value is not None})
+        self.warm_start = warm_start
+        self.neighbours = neighbours
+        self.symmetry_breaking = symmetry_breaking
         
         self.instance_data = {
             'couriers': None,
@@ -41,6 +149,7 @@ class MIP_solver:
         self.Z = None
         self.X = None
         self.u = None
+        self.arcs = None
 
     def read_from_file(self):
         with open(self.file_path, 'r') as file:
@@ -57,7 +166,7 @@ class MIP_solver:
             while True:
                 next_node = None
                 for j in range(self.instance_data['nodes']):
-                    if self.X[current_node][j][k].varValue == 1:
+                    if k in self.X[current_node][j] and self.X[current_node][j][k].varValue == 1:
                         next_node = j
                         break
                 if next_node == self.instance_data['nodes'] - 1:
@@ -86,7 +195,12 @@ class MIP_solver:
         up_bound = self.instance_data['D'][self.instance_data['nodes'] - 1, 0] + np.sum(np.diag(self.instance_data['D'], -1))
         return up_bound
 
-    def initialize_problem(self):
+    def read_instance(self):
+        """
+        Parses the instance file, only the first time it is called
+        """
+        if self.instance_data['couriers'] is not None:
+            return
         data = self.read_from_file()
         self.instance_data['couriers'] = data[0][0]
         self.instance_data['items'] = data[1][0]
@@ -95,117 +209,459 @@ class MIP_solver:
         self.instance_data['D'] = np.array(data[4:])
         self.instance_data['nodes'] = self.instance_data['items'] + 1
 
+    def set_admissible_arcs(self):
+        """
+        Arcs that get an X variable (see MIP.sparse.admissible_arcs). The greedy routes are kept when pruning by
+        distance, so the model still has a feasible routing; if the greedy assignment fails no arc is pruned by distance
+        """
+        neighbours, keep = self.neighbours, ()
+        if neighbours is not None:
+            heuristic = self.heuristic_solution()
+            if heuristic is None:
+                neighbours = None
+            else:
+                keep = heuristic[0]
+        self.arcs = admissible_arcs(self.instance_data['D'], self.instance_data['demands'], self.instance_data['capacities'], neighbours, keep)
+
+    def initialize_problem(self):
+        self.read_instance()
+        self.set_admissible_arcs()
         
         self.prob = LpProblem("Vehicle_Routing_Problem", LpMinimize)
-        self.X = LpVariable.dicts("X", (range(self.instance_data['nodes']), range(self.instance_data['nodes']), range(self.instance_data['couriers'])), lowBound=0, upBound=1, cat=LpBinary)
+        # X[i][j] only holds the couriers k of the admissible arcs
+        self.X = {i: {j: {} for j in range(self.instance_data['nodes'])} for i in range(self.instance_data['nodes'])}
+        for i, j, k in np.argwhere(self.arcs).tolist():
+            self.X[i][j][k] = LpVariable(f"X_{i}_{j}_{k}", cat=LpBinary)
         
         lb = self.set_Z_low_bound()
         ub = self.set_Z_up_bound()
         self.Z = LpVariable("Z", lowBound=lb, upBound=ub, cat=LpInteger)
         
-        if self.variation == 0:
-            # MTZ Constraints (Variation 0)
+        if self.variation in (0, 2):
+            # MTZ Constraints (Variation 0). Variation 2 has no MTZ constraints, its u variables are never
+            # constrained and so never written to the model file
             self.u = LpVariable.dicts("u", (range(self.instance_data['couriers']), range(self.instance_data['nodes'] - 1)), lowBound=0, upBound=self.instance_data['nodes'] - 1, cat=LpInteger)
         else:
             # MTZ Constraints (Variation 1)
             self.u = {k: {i: LpVariable(f"u_{i}_courier_{k}", lowBound=self.instance_data['demands'][i], upBound=self.instance_data['capacities'][k], cat=LpInteger) for i in range(self.instance_data['nodes'] - 1)} for k in range(self.instance_data['couriers'])}
 
+    def symmetric_pairs(self):
+        """
+        Pairs of interchangeable couriers, the first one of each pair delivering first, shared with the SAT models.
+        Interchangeable couriers also have the same admissible arcs, which only depend on the capacity
+        """
+        if not self.symmetry_breaking:
+            return []
+        return symmetric_pairs(self.instance_data['capacities'], self.instance_data['demands'])
+
+    def order_symmetric_tours(self, tours):
+        """
+        Swaps the tours of interchangeable couriers so that they satisfy the symmetry breaking constraints
+        """
+        groups = {k: {k} for k in range(self.instance_data['couriers'])}
+        for k1, k2 in self.symmetric_pairs():
+            merged = groups[k1] | groups[k2]
+            for k in merged:
+                groups[k] = merged
+        tours = list(tours)
+        for group in {frozenset(group) for group in groups.values()}:
+            couriers = sorted(group)
+            for k, tour in zip(couriers, sorted((tours[k] for k in couriers), key=lambda tour: tour[0])):
+                tours[k] = tour
+        return tours
+
+    def arc_variables(self, i=None, j=None, k=None):
+        """
+        X variables of the admissible arcs matching the given tail i, head j and courier k (None for any)
+        """
+        nodes = range(self.instance_data['nodes'])
+        return [self.X[a][b][c] for a in (nodes if i is None else [i]) for b in (nodes if j is None else [j])
+                for c in self.X[a][b] if k is None or c == k]
+
     def add_constraints(self):
-        # No self-loop constraint
-        for k in range(self.instance_data['couriers']):
-            for i in range(self.instance_data['nodes']):
-                self.prob += self.X[i][i][k] == 0
+        # Self-loops have no variable, so no constraint is needed to forbid them
 
-        # Vehicle leaves node that it enters
+        # Vehicle leaves node that it enters, unless the courier has no arc through it
         for k in range(self.instance_data['couriers']):
             for j in range(self.instance_data['nodes']):
-                self.prob += lpSum(self.X[i][j][k] for i in range(self.instance_data['nodes'])) == lpSum(self.X[j][i][k] for i in range(self.instance_data['nodes']))
+                into, out = self.arc_variables(j=j, k=k), self.arc_variables(i=j, k=k)
+                if into or out:
+                    self.prob += lpSum(into) == lpSum(out)
 
         # Each item visited exactly once constraint
         for j in range(self.instance_data['items']):
-            self.prob += lpSum(self.X[i][j][k] for i in range(self.instance_data['nodes']) for k in range(self.instance_data['couriers'])) == 1
+            self.prob += lpSum(self.arc_variables(j=j)) == 1
 
         # Each vehicle starts from the depot and returns constraint
         for k in range(self.instance_data['couriers']):
-            self.prob += lpSum(self.X[self.instance_data['nodes'] - 1][j][k] for j in range(self.instance_data['items'])) == 1
+            self.prob += lpSum(self.arc_variables(i=self.instance_data['nodes'] - 1, k=k)) == 1
 
         # Vehicle capacity constraint
         for k in range(self.instance_data['couriers']):
-            self.prob += lpSum(self.X[i][j][k] * self.instance_data['demands'][j] for i in range(self.instance_data['nodes']) for j in range(self.instance_data['nodes'] - 1)) <= self.instance_data['capacities'][k]
+            self.prob += lpSum(self.X[i][j][k] * self.instance_data['demands'][j] for i in range(self.instance_data['nodes']) for j in range(self.instance_data['nodes'] - 1) if k in self.X[i][j]) <= self.instance_data['capacities'][k]
 
         # Distance constraint
         for k in range(self.instance_data['couriers']):
-            self.prob += lpSum(self.instance_data['D'][i][j] * self.X[i][j][k] for i in range(self.instance_data['nodes']) for j in range(self.instance_data['nodes'])) <= self.Z
+            self.prob += lpSum(self.instance_data['D'][i][j] * self.X[i][j][k] for i in range(self.instance_data['nodes']) for j in range(self.instance_data['nodes']) if k in self.X[i][j]) <= self.Z
+
+        # Symmetry breaking, the 1-based index of the first item of k1 being lower than the one of k2
+        depot = self.instance_data['nodes'] - 1
+        for k1, k2 in self.symmetric_pairs():
+            first_item = [lpSum((j + 1) * self.X[depot][j][k] for j in range(self.instance_data['items']) if k in self.X[depot][j]) for k in (k1, k2)]
+            self.prob += first_item[0] + 1 <= first_item[1], f"symmetry_{k1}_{k2}"
 
-        # MTZ subtour elimination constraints
+        # MTZ subtour elimination constraints, only for the admissible arcs. In variation 1 these already
+        # are the pairs of items whose demands fit in the capacity of the courier
         if self.variation == 0:
             for k in range(self.instance_data['couriers']):
                 for i in range(self.instance_data['nodes'] - 1): 
                     for j in range(self.instance_data['nodes'] - 1):  
-                        self.prob += self.u[k][i] - self.u[k][j] + (self.instance_data['nodes'] - 1) * self.X[i][j][k] <= self.instance_data['nodes'] - 2, f"MTZ_{i}_{j}_{k}"
-        else:
+                        if k in self.X[i][j]:
+                            self.prob += self.u[k][i] - self.u[k][j] + (self.instance_data['nodes'] - 1) * self.X[i][j][k] <= self.instance_data['nodes'] - 2, f"MTZ_{i}_{j}_{k}"
+        elif self.variation == 1:
             for k in range(self.instance_data['couriers']):
                 for i in range(self.instance_data['nodes'] - 1):  
                     for j in range(self.instance_data['nodes'] - 1):  
-                        if self.instance_data['demands'][i] + self.instance_data['demands'][j] <= self.instance_data['capacities'][k]:
+                        if k in self.X[i][j]:
                             self.prob += self.u[k][i] - self.u[k][j] + self.instance_data['capacities'][k] * self.X[i][j][k] <= self.instance_data['capacities'][k] - self.instance_data['demands'][j], f"MTZ_{i}_{j}_{k}"
+        else:
+            # Variation 2: only the subtours of two items are cut up front, the others by the loop of run_subtour_loop
+            for i in range(self.instance_data['nodes'] - 1):
+                for j in range(i + 1, self.instance_data['nodes'] - 1):
+                    pair = self.arc_variables(i=i, j=j) + self.arc_variables(i=j, j=i)
+                    if pair:
+                        self.prob += lpSum(pair) <= 1, f"pair_{i}_{j}"
+
+    def variables(self):
+        """
+        PuLP variables in the column order of MIP.sparse.column_layout
+        """
+        couriers, nodes = self.instance_data['couriers'], self.instance_data['nodes']
+        X = [self.X[i][j][k] for i, j, k in np.argwhere(self.arcs).tolist()]
+        u = [self.u[k][i] for k in range(couriers) for i in range(nodes - 1)]
+        return X + u + [self.Z]
 
-    def solve(self):
-        result = {}
-
-        # Determine solvers to use
-        solvers = ['CBC', 'GLPK'] if self.solver_name.lower() == 'all' else [self.solver_name]
-        variations = [0, 1] if self.solver_name.lower() == 'all' else [self.variation]
-
-        for solver_name in solvers:
-            for var in variations:
-                self.variation = var
-                start_time = datetime.now()
+    def write_sparse_model(self, path, variables, variation, cuts=()):
+        """
+        Writes the same model as add_constraints to an MPS file, without building PuLP expressions.
+        Only reads the instance data, so runs of the subtour loop can write their models at the same time
+        :param cuts: Item sets of the subtour elimination cuts added to the model.
+        """
+        _, u, z = column_layout(self.arcs)
+        rows, cols, vals, senses, rhs = constraint_matrix(self.instance_data['D'], self.instance_data['demands'],
+                                                          self.instance_data['capacities'], variation, self.arcs, cuts, self.symmetric_pairs())
+        lower = np.array([var.lowBound for var in variables])
+        upper = np.array([var.upBound for var in variables])
+        binary = np.zeros(len(variables), dtype=bool)
+        binary[:u.min()] = True
+        write_mps(path, [var.name for var in variables], rows, cols, vals, senses, rhs, z, lower, upper, binary)
+
+    def model_path(self, directory):
+        """
+        MPS file of the current variation. The model only depends on the instance content, on the variation,
+        on the candidate list size and on the symmetry breaking
+        """
+        with open(self.file_path, 'rb') as file:
+            digest = hashlib.sha256(file.read() + f"variation={self.variation},neighbours={self.neighbours},symmetry_breaking={self.symmetry_breaking}".encode()).hexdigest()
+        return os.path.join(directory, f"{digest}.mps")
 
-                self.initialize_problem()
+    def prepare_model(self, directory):
+        """
+        Creates the variables of the current variation and writes its MPS file, unless it is already on disk
+        """
+        self.initialize_problem()
+        path = self.model_path(directory)
+        if os.path.exists(path):
+            return path
+
+        with atomic_path(path) as tmp_path:
+            if self.builder == 'sparse':
+                self.write_sparse_model(tmp_path, self.variables(), self.variation)
+            else:
                 self.add_constraints()
 
                 self.prob += self.Z
+                self.prob.writeMPS(tmp_path)
+        return path
 
-                preprocessing_time = (datetime.now() - start_time).total_seconds()
-                remaining_time = int(max(0, math.ceil(self.timelimit - preprocessing_time)))
-
-                if solver_name == 'GLPK':
-                    solver = GLPK_CMD(msg=self.verbosity,timeLimit=remaining_time)
-                else: 
-                    solver = PULP_CBC_CMD(msg=self.verbosity,timeLimit=remaining_time)
-
-                variation_suffix = "_MTZ_original" if var == 0 else "_MTZ_revisited"
-                solver_name_with_variation = solver_name + variation_suffix
-
-                self.prob.solve(solver)
+    def heuristic_solution(self):
+        """
+        Greedy capacity-feasible assignment with nearest-neighbour routing (see SAT/heuristic.py)
+        :return: (tours, objective) with 0-based items, or None if the greedy assignment fails.
+        """
+        self.read_instance()
+        heuristic = greedy_routing(self.instance_data['couriers'], self.instance_data['items'], self.instance_data['capacities'],
+                                   self.instance_data['demands'], self.instance_data['D'])
+        if heuristic is None:
+            return None
+        # Only a routing that satisfies the symmetry breaking constraints is a valid MIP start
+        tours, objective = heuristic
+        return self.order_symmetric_tours(tours), objective
+
+    def set_start_values(self, tours, objective):
+        """
+        Sets the X, u and Z values of the current variation to the given tours. u is the position of each item in
+        its tour in variation 0 and the load after delivering it in variation 1; the items a courier does not
+        deliver get a value that leaves every MTZ constraint of that courier satisfied
+        """
+        nodes, depot = self.instance_data['nodes'], self.instance_data['nodes'] - 1
+        demands = self.instance_data['demands']
+        for var in self.variables():
+            var.varValue = 0
+        for k, tour in enumerate(tours):
+            route = [depot] + tour + [depot]
+            for i, j in zip(route, route[1:]):
+                self.X[i][j][k].varValue = 1
+            for i in range(nodes - 1):
+                self.u[k][i].varValue = 1 if self.variation == 0 else demands[i]
+            load = 0
+            for position, i in enumerate(tour):
+                load += demands[i]
+                self.u[k][i].varValue = position + 1 if self.variation == 0 else load
+        self.Z.varValue = objective
+
+    def run_solver(self, path, solver_name, time_limit, options, variables, start=None):
+        """
+        Runs CBC or GLPK on the MPS file in its own subprocess with the given solver parameters.
+        Only reads the variable names, so several runs can wait at the same time.
+        start is an optional (solution file, objective) pair CBC starts from, its objective being the cutoff (None for no cutoff)
+        :return: PuLP status, PuLP solution status (optimal or only feasible), value of every variable by name and solver runtime in seconds.
+        """
+        output = None if self.verbosity else subprocess.DEVNULL
+        solution_directory = tempfile.TemporaryDirectory()
+        directory = solution_directory.name
+        start_time = datetime.now()
+        if solver_name == 'GLPK':
+            solver = GLPK_CMD(msg=self.verbosity, timeLimit=time_limit)
+            out_file, sol_file = os.path.join(directory, 'model.out'), os.path.join(directory, 'model.sol')
+            subprocess.run([solver.path, '--freemps', path, '-o', out_file, '-w', sol_file, '--tmlim', str(time_limit)] + glpk_options(options),
+                           stdout=output, stderr=output, check=True)
+            runtime = (datetime.now() - start_time).total_seconds()
+            status, values = solver.readsol(out_file, sol_file)
+            sol_status = glpk_solution_status(out_file)
+        else:
+            solver = PULP_CBC_CMD(msg=self.verbosity, timeLimit=time_limit)
+            warm_start_options = [] if start is None else ['-mips', start[0]] + ([] if start[1] is None else ['-cutoff', str(start[1])])
+            sol_file = os.path.join(directory, 'model.sol')
+            subprocess.run([solver.path, path, '-sec', str(time_limit), '-timeMode', 'elapsed'] + cbc_options(options) + warm_start_options + ['-solve', '-printingOptions', 'all', '-solution', sol_file],
+                           stdout=output, stderr=output, stdin=subprocess.DEVNULL, check=True)
+            runtime = (datetime.now() - start_time).total_seconds()
+            status, values, _, _, _, sol_status = solver.readsol_MPS(sol_file, None, variables, {var.name: var.name for var in variables}, {})
+
+        solution_directory.cleanup()
+        return status, sol_status, values, runtime
+
+    def courier_cycles(self, values, variables):
+        """
+        Cycles of every courier in the solution, in visiting order. Flow conservation and the single visit
+        of every item make the arcs of each courier disjoint cycles, which are followed from every node
+        :return: For each courier, the list of its cycles.
+        """
+        arcs = np.argwhere(self.arcs)
+        used = np.array([values.get(var.name) or 0 for var in variables[:len(arcs)]]) > 0.5
+        cycles = []
+        for k in range(self.instance_data['couriers']):
+            successor = dict(arcs[used & (arcs[:, 2] == k), :2].tolist())
+            seen = set()
+            cycles.append([])
+            for node in successor:
+                cycle = []
+                while node not in seen:
+                    seen.add(node)
+                    cycle.append(node)
+                    node = successor[node]
+                if cycle:
+                    cycles[k].append(cycle)
+        return cycles
+
+    def subtours(self, values, variables):
+        """
+        Cycles of the solution that do not go through the depot
+        :return: Sorted item sets of the subtours.
+        """
+        depot = self.instance_data['nodes'] - 1
+        return [sorted(cycle) for courier in self.courier_cycles(values, variables) for cycle in courier if depot not in cycle]
 
-                end_time = datetime.now()
-                actual_runtime = (end_time - start_time).total_seconds()
-                time = min(math.floor(actual_runtime), self.timelimit)
+    def spliced_tours(self, values, variables):
+        """
+        Routing made of the solution by splicing every subtour into the tour of its courier, where it adds the
+        least distance over admissible arcs. The couriers keep their items, so the capacities still hold.
+        Nothing is inserted right after the depot of a non-empty tour, which keeps the first items
+        :return: (tours, objective) with 0-based items, or None if a subtour cannot be spliced or the symmetry breaking rows fail.
+        """
+        depot = self.instance_data['nodes'] - 1
+        D = self.instance_data['D']
+        tours = []
+        for k, cycles in enumerate(self.courier_cycles(values, variables)):
+            route = next((cycle for cycle in cycles if depot in cycle), [depot])
+            route = route[route.index(depot):] + route[:route.index(depot)] + [depot]
+            for cycle in cycles:
+                if depot in cycle:
+                    continue
+                # The cycle is opened at its arc p -> q and entered at q from a, then left at p for b
+                candidates = [(D[a][q] + D[p][b] - D[a][b] - D[p][q], position, c)
+                              for position, (a, b) in enumerate(zip(route, route[1:])) if a != depot or len(route) == 2
+                              for c, (p, q) in enumerate(zip(cycle, cycle[1:] + cycle[:1]))
+                              if self.arcs[a, q, k] and self.arcs[p, b, k]]
+                if not candidates:
+                    return None
+                _, position, c = min(candidates)
+                route = route[:position + 1] + cycle[c + 1:] + cycle[:c + 1] + route[position + 1:]
+            tours.append(route[1:-1])
+        first_item = [tour[0] + 1 if tour else 0 for tour in tours]
+        if any(first_item[k1] + 1 > first_item[k2] for k1, k2 in self.symmetric_pairs()):
+            return None
+        objective = max(sum(D[i][j] for i, j in zip([depot] + tour, tour + [depot])) for tour in tours)
+        return tours, int(objective)
+
+    def tour_values(self, variables, tours, objective):
+        """
+        Values of the X and Z variables of the given tours by name, read from the column order of the variables
+        """
+        depot = self.instance_data['nodes'] - 1
+        columns = dict(zip(map(tuple, np.argwhere(self.arcs).tolist()), variables))
+        values = {columns[(i, j, k)].name: 1 for k, tour in enumerate(tours) for i, j in zip([depot] + tour, tour + [depot]) if i != j}
+        values[variables[-1].name] = objective
+        return values
 
+    def run_subtour_loop(self, path, solver_name, time_limit, options, variables, start=None):
+        """
+        Variation 2: solves the model without subtour constraints, adds a cut for every subtour of the
+        solution and solves again, until a solution has no subtours. CBC starts every round from the routing
+        spliced from the solution of the previous one, when it improves on the current start. The cuts hold
+        for every feasible routing, so the cutoff of the initial start stays valid in every round
+        :return: PuLP status, PuLP solution status of the last round, value of every variable by name and runtime of the whole loop in seconds.
+        """
+        cut_directory = tempfile.TemporaryDirectory()
+        start_time = datetime.now()
+        cuts = []
+        cutoff = start_objective = None if start is None else start[1]
+        while True:
+            remaining = time_limit - (datetime.now() - start_time).total_seconds()
+            status, sol_status, values, _ = self.run_solver(path, solver_name, max(1, math.ceil(remaining)), options, variables, start)
+            runtime = (datetime.now() - start_time).total_seconds()
+            if status != LpStatusOptimal:
+                break
+            subtours = self.subtours(values, variables)
+            if not subtours:
+                break
+            if runtime >= time_limit:
+                # The last solution still has subtours, it is not a routing
+                status, sol_status, values = LpStatusNotSolved, LpSolutionNoSolutionFound, {}
+                break
+            cuts += subtours
+            path = os.path.join(cut_directory.name, f"cuts_{len(cuts)}.mps")
+            self.write_sparse_model(path, variables, 2, cuts)
+            spliced = self.spliced_tours(values, variables) if solver_name == 'CBC' else None
+            if spliced is not None and (start_objective is None or spliced[1] < start_objective):
+                start_path = os.path.join(cut_directory.name, f"start_{len(cuts)}.sol")
+                write_start(start_path, variables, self.tour_values(variables, *spliced))
+                start, start_objective = (start_path, cutoff), spliced[1]
+        cut_directory.cleanup()
+        return status, sol_status, values, runtime
+
+    def load_solution(self, variables, status, values):
+        """
+        Loads a solution into the PuLP variables and problem status of the current variation
+        """
+        for var in variables:
+            var.varValue = values.get(var.name)
+        self.prob.assignStatus(status)
 
-                status = LpStatus[self.prob.status]
-                if status != 'Optimal':
-                    result[solver_name_with_variation] = {
-                        "time": time,
-                        "optimal": False,
-                        "obj": None,
-                        "sol": []
-                    }
-                else:
-                    sol = self.extract_solution()
+    def solve(self):
+        result = {}
 
-                    optimal = LpStatus[self.prob.status] == 'Optimal'
-                    if time >= self.timelimit:
-                        optimal = False
+        # Determine solvers to use
+        solvers = ['CBC', 'GLPK'] if self.solver_name.lower() == 'all' else [self.solver_name]
+        variations = [0, 1] if self.solver_name.lower() == 'all' else [self.variation]
 
-                    result[solver_name_with_variation] = {
-                        "time": time,
-                        "optimal": optimal,
-                        "obj": self.Z.varValue,
-                        "sol": sol
-                    }
+        # Every variation is built and written once, then solved from the same file by each solver
+        model_directory = None if self.cache_directory else tempfile.TemporaryDirectory()
+        directory = self.cache_directory or model_directory.name
+        os.makedirs(directory, exist_ok=True)
+
+        # The heuristic solution is written once per variation in the names of its MPS file
+        heuristic = self.heuristic_solution() if self.warm_start else None
+        start_directory = tempfile.TemporaryDirectory() if heuristic is not None else None
+
+        models = {}
+        for var in variations:
+            self.variation = var
+            model_path = self.prepare_model(directory)
+            variables = self.variables()
+            start = None
+            if heuristic is not None:
+                self.set_start_values(*heuristic)
+                start_path = os.path.join(start_directory.name, f"start_{var}.sol")
+                PULP_CBC_CMD().writesol(start_path, self.prob, variables, {var.name: var.name for var in variables}, {})
+                start = (start_path, heuristic[1])
+            models[var] = (model_path, self.prob, self.X, self.u, self.Z, variables, start)
+
+        # The combinations run as concurrent solver subprocesses, the cores being split between
+        # the ones running at the same time. Only the solver run counts against the time limit
+        combinations = [(solver_name, var) for solver_name in solvers for var in variations]
+        workers = min(self.workers, len(combinations))
+        options = dict(self.options)
+        options.setdefault('threads', max(1, (os.cpu_count() or 1) // workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            runs = {(solver_name, var): executor.submit(self.run_subtour_loop if var == 2 else self.run_solver, models[var][0], solver_name, self.timelimit, options, models[var][5],
+                                                         models[var][6] if solver_name == 'CBC' else None)
+                    for solver_name, var in combinations}
+
+        for solver_name, var in combinations:
+            status, sol_status, values, actual_runtime = runs[(solver_name, var)].result()
+            self.variation = var
+            _, self.prob, self.X, self.u, self.Z, variables, _ = models[var]
+            self.load_solution(variables, status, values)
+
+            variation_suffix = ["_MTZ_original", "_MTZ_revisited", "_subtour_cuts"][var]
+            solver_name_with_variation = solver_name + variation_suffix
+
+            time = min(math.floor(actual_runtime), self.timelimit)
+
+
+            status = LpStatus[self.prob.status]
+            if status != 'Optimal' and heuristic is not None:
+                # The heuristic routing is still a feasible answer. CBC only accepts solutions strictly better
+                # than the cutoff, so proving that infeasible proves the heuristic routing optimal
+                proven = status == 'Infeasible' and solver_name == 'CBC' and heuristic[1] <= self.Z.upBound and time < self.timelimit and self.neighbours is None
+                result[solver_name_with_variation] = {
+                    "time": time,
+                    "optimal": proven,
+                    "obj": heuristic[1],
+                    "sol": [[j + 1 for j in tour] for tour in heuristic[0]]
+                }
+            elif status != 'Optimal':
+                result[solver_name_with_variation] = {
+                    "time": time,
+                    "optimal": False,
+                    "obj": None,
+                    "sol": []
+                }
+            else:
+                sol = self.extract_solution()
+
+                # A run stopped by the time limit reports its incumbent with the same problem status
+                # as an optimal one, only the solution status tells them apart
+                optimal = sol_status == LpSolutionOptimal
+                # CBC also reports a search stopped at a gap as optimal
+                if self.options.get('gap_rel') or self.options.get('gap_abs'):
+                    optimal = False
+                # Without the arcs pruned by distance, the model may miss better routings
+                if self.neighbours is not None:
+                    optimal = False
+
+                result[solver_name_with_variation] = {
+                    "time": time,
+                    "optimal": optimal,
+                    "obj": self.Z.varValue,
+                    "sol": sol
+                }
+
+        if model_directory is not None:
+            model_directory.cleanup()
+        if start_directory is not None:
+            start_directory.cleanup()
 
         # Save results to a JSON file
         os.makedirs(self.save_directory, exist_ok=True)
@@ -227,6 +683,14 @@ class MIP_solver:
                         save_directory=self.save_directory,
                         verbosity=self.verbosity,
                         solver_name=self.solver_name,
-                        variation=self.variation)
+                        variation=self.variation,
+                        builder=self.builder,
+                        cache_directory=self.cache_directory,
+                        workers=self.workers,
+                        preset=self.preset,
+                        warm_start=self.warm_start,
+                        neighbours=self.neighbours,
+                        symmetry_breaking=self.symmetry_breaking,
+                        **self.options)
 
             self.solve()
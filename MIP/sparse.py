@@ -0,0 +1,197 @@
+import numpy as np
+
+def admissible_arcs(D, demands, capacities, neighbours=None, keep=()):
+    """
+    Arcs (i, j, k) that get a variable: off-diagonal arcs whose items courier k can carry together, the depot
+    being the last node. With neighbours, j must also be among the neighbours nodes closest to i, or i among the
+    ones closest to j, arcs from and to the depot and the arcs of the routes in keep being always admissible.
+
+    :param neighbours: Size of the candidate list of every node (None to keep every capacity-feasible arc).
+    :param keep: Item routes, one per courier, whose arcs are never pruned by distance.
+    :return: Boolean array indexed by [i, j, k].
+    """
+    D = np.asarray(D)
+    capacities = np.asarray(capacities)
+    nodes = D.shape[0]
+    depot = nodes - 1
+    load = np.append(demands, 0)
+    arcs = (load[:, None, None] + load[None, :, None] <= capacities) & ~np.eye(nodes, dtype=bool)[:, :, None]
+
+    if neighbours is not None:
+        # Ties are broken by index, a node is never its own neighbour
+        distances = np.where(np.eye(nodes, dtype=bool), np.inf, D)
+        near = np.zeros((nodes, nodes), dtype=bool)
+        near[np.arange(nodes)[:, None], np.argsort(distances, axis=1, kind='stable')[:, :neighbours]] = True
+        near[np.argsort(distances, axis=0, kind='stable')[:neighbours, :], np.arange(nodes)] = True
+        near[depot, :] = near[:, depot] = True
+        for route in keep:
+            route = [depot] + list(route) + [depot]
+            near[route[:-1], route[1:]] = True
+        arcs &= near[:, :, None]
+    return arcs
+
+def column_layout(arcs):
+    """
+    Column indices of the model variables, in the order of the PuLP variables: the admissible X[i][j][k]
+    in (i, j, k) order, -1 for the others, then u[k][i] for every courier and item, then Z.
+    """
+    nodes, _, couriers = arcs.shape
+    items = nodes - 1
+    count = np.count_nonzero(arcs)
+    x = np.full(arcs.shape, -1)
+    x[arcs] = np.arange(count)
+    u = count + np.arange(couriers * items).reshape(couriers, items)
+    z = count + u.size
+    return x, u, z
+
+def constraint_matrix(D, demands, capacities, variation, arcs, cuts=(), symmetric=()):
+    """
+    Constraint matrix of the MIP model in coordinate form, with the same rows as
+    MIP_solver.add_constraints, built from index arrays instead of lpSum loops.
+    The blocks are written over every (i, j, k), the entries of the arcs that are not admissible are dropped.
+
+    :param D: Distance matrix, the depot being the last node.
+    :param demands: Size of each item.
+    :param capacities: Capacity of each courier.
+    :param variation: Which variation of MTZ constraints to use (0 or 1), 2 for none.
+    :param arcs: Admissible arcs, see admissible_arcs.
+    :param cuts: Item sets S of subtour elimination cuts: at most |S| - 1 arcs inside S over all couriers.
+    :param symmetric: Pairs (k1, k2) of interchangeable couriers, the first item of k1 coming before the first item of k2.
+    :return: rows, cols and vals of the nonzero entries, then the sense ('E' or 'L') and right-hand side of each row.
+    """
+    D = np.asarray(D)
+    demands = np.asarray(demands)
+    capacities = np.asarray(capacities)
+    nodes = D.shape[0]
+    items = nodes - 1
+    couriers = len(capacities)
+    depot = nodes - 1
+    x, u, z = column_layout(arcs)
+
+    blocks = []
+    def add(rows, cols, vals, senses, rhs):
+        # rows are numbered from 0 within the block
+        blocks.append((np.asarray(rows).ravel(), np.asarray(cols).ravel(), np.broadcast_to(vals, np.shape(cols)).ravel(),
+                       np.broadcast_to(senses, np.shape(rhs)).ravel(), np.asarray(rhs).ravel()))
+
+    # Vehicle leaves node that it enters
+    K, J, I = np.meshgrid(np.arange(couriers), np.arange(nodes), np.arange(nodes), indexing='ij')
+    mask = I != J
+    K, J, I = K[mask], J[mask], I[mask]
+    rows = K * nodes + J
+    add(np.concatenate([rows, rows]), np.concatenate([x[I, J, K], x[J, I, K]]),
+        np.repeat([1, -1], rows.size), 'E', np.zeros(couriers * nodes, dtype=int))
+
+    # Each item visited exactly once constraint
+    J, I, K = np.meshgrid(np.arange(items), np.arange(nodes), np.arange(couriers), indexing='ij')
+    add(J, x[I, J, K], 1, 'E', np.ones(items, dtype=int))
+
+    # Each vehicle starts from the depot and returns constraint
+    K, J = np.meshgrid(np.arange(couriers), np.arange(items), indexing='ij')
+    add(K, x[depot, J, K], 1, 'E', np.ones(couriers, dtype=int))
+
+    # Vehicle capacity constraint
+    K, I, J = np.meshgrid(np.arange(couriers), np.arange(nodes), np.arange(items), indexing='ij')
+    add(K, x[I, J, K], demands[J], 'L', capacities)
+
+    # Distance constraint, Z being moved to the left-hand side
+    K, I, J = np.meshgrid(np.arange(couriers), np.arange(nodes), np.arange(nodes), indexing='ij')
+    add(np.concatenate([K.ravel(), np.arange(couriers)]), np.concatenate([x[I, J, K].ravel(), np.full(couriers, z)]),
+        np.concatenate([D[I, J].ravel(), np.full(couriers, -1)]), 'L', np.zeros(couriers, dtype=int))
+
+    # Symmetry breaking, the 1-based index of the first item of k1 being lower than the one of k2
+    for k1, k2 in symmetric:
+        J = np.arange(items)
+        add(np.zeros(2 * items, dtype=int), np.concatenate([x[depot, J, k1], x[depot, J, k2]]),
+            np.concatenate([J + 1, -(J + 1)]), 'L', np.array([-1]))
+
+    # Variation 2 has no MTZ constraints, only the cuts of the subtours of two items, which are most of
+    # the subtours found by its loop: at most one arc between i and j over all couriers
+    if variation == 2:
+        I, J, K = np.meshgrid(np.arange(items), np.arange(items), np.arange(couriers), indexing='ij')
+        mask = I < J
+        I, J, K = I[mask], J[mask], K[mask]
+        pairs = np.triu_indices(items, 1)
+        rows = np.zeros((items, items), dtype=int)
+        rows[pairs] = np.arange(len(pairs[0]))
+        add(np.concatenate([rows[I, J], rows[I, J]]), np.concatenate([x[I, J, K], x[J, I, K]]), 1, 'L', np.ones(len(pairs[0]), dtype=int))
+
+    # MTZ subtour elimination constraints, one per admissible arc between two items
+    else:
+        K, I, J = np.meshgrid(np.arange(couriers), np.arange(items), np.arange(items), indexing='ij')
+        mask = arcs[I, J, K]
+        K, I, J = K[mask], I[mask], J[mask]
+        if variation == 0:
+            coefficient = np.full(K.size, items)
+            rhs = np.full(K.size, items - 1)
+        else:
+            coefficient = capacities[K]
+            rhs = capacities[K] - demands[J]
+        rows = np.arange(K.size)
+        add(np.concatenate([rows, rows, rows]), np.concatenate([x[I, J, K], u[K, I], u[K, J]]),
+            np.concatenate([coefficient, np.ones(K.size, dtype=int), -np.ones(K.size, dtype=int)]), 'L', rhs)
+
+    # Subtour elimination cuts
+    for S in cuts:
+        S = np.asarray(S)
+        I, J, K = np.meshgrid(S, S, np.arange(couriers), indexing='ij')
+        mask = I != J
+        add(np.zeros(mask.sum(), dtype=int), x[I[mask], J[mask], K[mask]], 1, 'L', np.array([len(S) - 1]))
+
+    offset = 0
+    all_rows, all_cols, all_vals, all_senses, all_rhs = [], [], [], [], []
+    for rows, cols, vals, senses, rhs in blocks:
+        all_rows.append(rows + offset)
+        all_cols.append(cols)
+        all_vals.append(vals)
+        all_senses.append(senses)
+        all_rhs.append(rhs)
+        offset += rhs.size
+    rows, cols, vals = np.concatenate(all_rows), np.concatenate(all_cols), np.concatenate(all_vals)
+    senses, rhs = np.concatenate(all_senses), np.concatenate(all_rhs)
+    entries = (vals != 0) & (cols >= 0)
+    rows, cols, vals = rows[entries], cols[entries], vals[entries]
+
+    # Rows left without entries are dropped when 0 satisfies them, as those of the items a courier cannot carry
+    used = np.zeros(rhs.size, dtype=bool)
+    used[rows] = True
+    kept = used | ~np.where(senses == 'E', rhs == 0, rhs >= 0)
+    return (np.cumsum(kept) - 1)[rows], cols, vals, senses[kept], rhs[kept]
+
+def write_mps(path, names, rows, cols, vals, senses, rhs, objective, lower, upper, binary):
+    """
+    Writes a minimization problem over integer variables in free MPS format.
+
+    :param names: Name of every column.
+    :param objective: Column minimized, with coefficient 1.
+    :param lower: Lower bound of every column.
+    :param upper: Upper bound of every column.
+    :param binary: Whether every column is binary, its bounds are then ignored.
+    """
+    row_names = np.char.add('R', np.arange(len(rhs)).astype(str))
+    # Columns are written in order with their entries grouped, the objective being one more entry
+    entry_rows = np.concatenate([row_names[rows], ['OBJ']])
+    entry_cols = np.concatenate([cols, [objective]])
+    entry_vals = np.concatenate([vals, [1]])
+    order = np.argsort(entry_cols, kind='stable')
+    names = np.asarray(names)
+    # As in PuLP, columns without any entry are left out of the file, bounds included
+    present = np.zeros(len(names), dtype=bool)
+    present[entry_cols] = True
+    binary = binary & present
+    bounded = ~binary & present
+
+    with open(path, 'w') as file:
+        file.write("NAME MCP\nROWS\n N OBJ\n")
+        file.write("".join(f" {sense} {name}\n" for sense, name in zip(senses.tolist(), row_names.tolist())))
+        file.write("COLUMNS\n    MARKER 'MARKER' 'INTORG'\n")
+        file.write("".join(f"    {col} {row} {val}\n" for col, row, val in
+                           zip(names[entry_cols[order]].tolist(), entry_rows[order].tolist(), entry_vals[order].tolist())))
+        file.write("    MARKER 'MARKER' 'INTEND'\nRHS\n")
+        nonzero = np.flatnonzero(rhs != 0)
+        file.write("".join(f"    RHS {row} {value}\n" for row, value in zip(row_names[nonzero].tolist(), rhs[nonzero].tolist())))
+        file.write("BOUNDS\n")
+        file.write("".join(f" BV BND {name}\n" for name in names[binary].tolist()))
+        file.write("".join(f" LO BND {name} {low}\n UP BND {name} {up}\n" for name, low, up in
+                           zip(names[bounded].tolist(), lower[bounded].tolist(), upper[bounded].tolist())))
+        file.write("ENDATA\n")
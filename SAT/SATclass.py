@@ -1,10 +1,18 @@
 from z3 import *
-from itertools import combinations
+from itertools import combinations, product
 from collections import defaultdict
 import time
 import json
 from pathlib import Path
 import os
+import multiprocessing
+import hashlib
+import re
+from SAT.SAT import exactly_one_seq, exactly_one_bw, exactly_one_he
+from SAT.heuristic import greedy_routing, fair_item_counts, symmetric_pairs
+from SAT.deadline import Deadline
+from SAT.files import atomic_path
+from SAT import smtlib
 
 def at_least_one(bool_vars):
     return Or(bool_vars)
@@ -15,6 +23,39 @@ def at_most_one(bool_vars, name=""):
 def exactly_one(bool_vars, name=""):
     return at_most_one(bool_vars) + [at_least_one(bool_vars)]
 
+def exactly_one_pb(bool_vars):
+    # Native cardinality constraint: no auxiliary clauses, whatever the group size
+    return PbEq([(var, 1) for var in bool_vars], 1)
+
+# Exactly-one encodings available for the position model, see SAT/SAT.py
+ENCODINGS = {
+    'pairwise': lambda bool_vars, name="": exactly_one(bool_vars, name),
+    'sequential': exactly_one_seq,
+    'bitwise': exactly_one_bw,
+    'heule': exactly_one_he,
+    'native': lambda bool_vars, name="": exactly_one_pb(bool_vars)
+}
+
+# Preprocessing tactics applied once to the formula before the descent. The bound constraints
+# are added to the preprocessed formula, so a pipeline must keep the variables they mention:
+# bit-blasting presets are not offered, since they eliminate max_distance and, even solved
+# incrementally (z3's QF_FD solver), were slower than the default solver on every instance tried
+TACTICS = {
+    'default': None,
+    'simplify': ['simplify', 'propagate-values', 'solve-eqs']
+}
+
+# Modes handing the objective to z3 Optimize, with the MaxSAT engine each one uses
+OPTIMIZERS = {
+    'minimize': 'maxres',
+    'maxres': 'maxres',
+    'wmax': 'wmax',
+    'rc2': 'rc2'
+}
+
+# Soft bounds of each MaxSAT round, evenly spaced between the lower bound and the incumbent
+SOFT_BOUNDS = 8
+
 def read_dat_file(filename):
     with open(filename, 'r') as file:
         m = int(file.readline().strip())
@@ -40,6 +81,12 @@ def get_dict(time, model, dist, x, optimal):
         "optimal": optimal
     }
 
+def no_solution(time, x):
+    # Run that found no solution within its deadline
+    out = get_dict(time, None, None, x, False)
+    out['tours'] = []
+    return out
+
 def calculate_lower_bound(D):
     origin = len(D) - 1
     lower_bound = 0
@@ -65,49 +112,460 @@ def calculate_upper_bound(D, n, m):
     
     return sum(sorted_D[:stops+1])
 
+def load_constraints(carries, m, n, l, s):
+    # a[i][j] is True if courier i carries item j, i.e. if any literal of carries[i][j] holds.
+    # The capacity is then a pseudo-Boolean constraint over these literals, which keeps
+    # the load side out of integer arithmetic
+    a = [[Bool(f'a_{i}_{j}') for j in range(n)] for i in range(m)]
+    constraints = []
+    for i in range(m):
+        for j in range(n):
+            constraints.append(a[i][j] == Or(carries[i][j]))
+        constraints.append(PbLe([(a[i][j], s[j]) for j in range(n)], l[i]))
+    return a, constraints
+
+def position_variables(m, n, horizons):
+    # x[i][j][k] for k in 0..horizons[i]+1, the first and last positions being the depot
+    return [[[Bool(f'x_{i}_{j}_{k}') for k in range(horizons[i]+2)] for j in range(n+1)] for i in range(m)]
+
+def position_groups(x, m, n):
+    # Exactly-one groups of the position model, with the names used for their auxiliary variables.
+    # Couriers may have different horizons, so positions are counted on x itself
+    groups = [([x[i][j][k] for j in range(n+1)], f"visit_e1_{i}_{k}") for i in range(m) for k in range(len(x[i][n]))]
+    groups += [([x[i][j][k] for i in range(m) for k in range(1,len(x[i][j])-1)], f"point_e1_{j}") for j in range(n)]
+    return groups
+
+def true_literals(model, prefix):
+    # Indices of the Boolean variables named prefix_a_b_c that are true in the model.
+    # The model is read once in textual form instead of evaluating every literal,
+    # variables missing from the model are don't-cares and count as false
+    pattern = r'\(define-fun (' + prefix + r'_[0-9_]+) \(\) Bool\s+true\)'
+    return [tuple(int(index) for index in name.split('_')[1:]) for name in re.findall(pattern, model.sexpr())]
+
+def position_tours(model, m, n):
+    # Items of each courier ordered by position, the depot (point n) is left out
+    stops = [[] for _ in range(m)]
+    for i, j, k in true_literals(model, 'x'):
+        if j != n:
+            stops[i].append((k, j))
+    return [[j for _, j in sorted(courier_stops)] for courier_stops in stops]
+
+def arc_tours(model, m, n):
+    # Follow the successor arcs of each courier from the depot back to the depot
+    successor = [{} for _ in range(m)]
+    for i, j1, j2 in true_literals(model, 'y'):
+        successor[i][j1] = j2
+    tours = []
+    for i in range(m):
+        tour = []
+        current = successor[i][n]
+        while current != n:
+            tour.append(current)
+            current = successor[i][current]
+        tours.append(tour)
+    return tours
+
+def constant_names(exprs):
+    # Names of the uninterpreted constants occurring in exprs, shared subterms are visited once
+    names, seen, stack = set(), set(), list(exprs)
+    while stack:
+        expr = stack.pop()
+        if expr.get_id() in seen:
+            continue
+        seen.add(expr.get_id())
+        if is_const(expr) and expr.decl().kind() == Z3_OP_UNINTERPRETED:
+            names.add(expr.decl().name())
+        stack.extend(expr.children())
+    return names
+
+def route_length(route, D):
+    return sum(D[j1][j2] for j1, j2 in zip(route, route[1:]))
+
+def tours_distance(tours, D):
+    # Longest route of the 1-based tours, each one leaving from the depot and coming back
+    depot = len(D) - 1
+    return max(route_length([depot] + [j-1 for j in tour] + [depot], D) for tour in tours)
+
+def check_result(name, result, D):
+    # The reported objective must be the length of the reported tours
+    if result['obj'] is not None and tours_distance(result['sol'], D) != result['obj']:
+        raise ValueError(f"{name}: objective {result['obj']} does not match the tours of length {tours_distance(result['sol'], D)}")
+
+def portfolio_worker(task):
+    # Runs one portfolio variant in its own process. z3 models cannot be pickled,
+    # so the tours are decoded here and only plain values are sent back
+    name, options, symmetry_breaking, m, n, l, s, D, deadline = task
+    solver = SAT_solver(**options)
+    if symmetry_breaking:
+        out = solver.solve_mcp_sym(m, n, l, s, D, deadline)
+    else:
+        out = solver.solve_mcp_nosym(m, n, l, s, D, deadline)
+
+    return name, {
+        "time": min(int(out['time']), solver.timelimit),
+        "optimal": out['optimal'],
+        "obj": out['distance'],
+        "sol": solver.extract_tours(out, m, n)
+    }
+
+def heavy_item_cubes(m, n, l, s, k):
+    # Every way of giving the k heaviest items to couriers that can carry them. Couriers with
+    # the same capacity and the same fair division count are interchangeable, so only the
+    # assignments where they first appear in index order are kept. Each cube is a list of
+    # (courier, item)
+    heaviest = sorted(range(n), key=lambda j: s[j], reverse=True)[:k]
+    minimum = fair_item_counts(m, n, l)
+    groups = defaultdict(list)
+    for i in range(m):
+        groups[(l[i], minimum[i])].append(i)
+
+    cubes = []
+    for couriers in product(range(m), repeat=len(heaviest)):
+        loads = defaultdict(int)
+        for i, j in zip(couriers, heaviest):
+            loads[i] += s[j]
+        if any(loads[i] > l[i] for i in loads):
+            continue
+        first_seen = list(dict.fromkeys(couriers))
+        canonical = True
+        for group in groups.values():
+            used = [i for i in first_seen if i in group]
+            canonical = canonical and used == group[:len(used)]
+        if canonical:
+            cubes.append(list(zip(couriers, heaviest)))
+    return cubes
+
+# State of a cube worker process, set once by cube_worker_init
+cube_state = {}
+
+def cube_worker_init(options, formula, best, m, n, l, s, D, deadline):
+    # Every worker parses the base formula once and keeps its solver, with its learned
+    # clauses, for all the cubes it is given
+    sat_solver = SAT_solver(**options)
+    solver = Solver()
+    solver.from_string(formula)
+    encoding = sat_solver.arc_encoding(m, n, D) if sat_solver.model == 'arc' else sat_solver.position_encoding(m, n, l, s, D)
+    cube_state.update(sat_solver=sat_solver, solver=solver, encoding=encoding, best=best, deadline=deadline)
+
+def cube_worker(cube):
+    # Descends inside the cube, always probing just below the best value found by any
+    # worker. The cube is closed once that probe is unsat
+    sat_solver, solver, encoding = cube_state['sat_solver'], cube_state['solver'], cube_state['encoding']
+    best, deadline = cube_state['best'], cube_state['deadline']
+    literals = [Bool(f'a_{i}_{j}') for i, j in cube]
+    found = None
+    while not deadline.expired():
+        bound = best.value - 1
+        if bound < encoding['lower_bound']:
+            return found, True
+        guard = sat_solver.bound_guard(solver, encoding, bound)
+        solver.set("timeout", int(deadline.remaining() * 1000))
+        with deadline.watchdog(solver.ctx):
+            status = solver.check(literals + [guard])
+        if status == sat:
+            model = solver.model()
+            value = encoding['objective'](model)
+            with best.get_lock():
+                if value < best.value:
+                    best.value = value
+            found = (value, [[j+1 for j in tour] for tour in encoding['tours'](model)])
+        elif status == unsat:
+            return found, True
+        else:
+            break
+    return found, False
+
 class SAT_solver:
-    def __init__(self, instance_number, timelimit=300, save_directory='/res/SAT', verbosity='s'):
+    def __init__(self, instance_number, timelimit=300, save_directory='/res/SAT', verbosity='s', search='linear', model='position', encoding='pairwise', portfolio=False, cache_directory=None, tactic='default', warm_start=False, optimizer='descent', backend='ast', phase_hints=False, cubes=0, workers=None):
         
         self.instance_number = instance_number
         self.file_path = os.path.join(os.getcwd(), 'instances', f'inst{instance_number:02d}.dat')
         self.timelimit = timelimit
         self.save_directory = save_directory
         self.verbosity = 1 if verbosity == 'v' else 0
+        # Descent strategy on max_distance: 'linear', 'binary' or 'hybrid'
+        self.search = search
+        # SAT model: 'position' (x[i][j][k] stop literals) or 'arc' (y[i][j1][j2] successor literals)
+        self.model = model
+        # Exactly-one encoding of the position model (the arc model always uses native cardinality)
+        self.encoding = encoding
+        # Race every (encoding, symmetry breaking) variant in its own process
+        self.portfolio = portfolio
+        # Folder where encoded formulas are stored as SMT-LIB2 and reloaded by later runs (None disables it)
+        self.cache_directory = cache_directory
+        # Preset of TACTICS used to build the solver
+        self.tactic = tactic
+        # Start the descent from a greedy solution, used as incumbent and as phase hint
+        self.warm_start = warm_start
+        # 'descent' for the search of minimize(), otherwise the z3 Optimize engine (see OPTIMIZERS)
+        self.optimizer = optimizer
+        # Formula construction: 'ast' through the z3 Python API, 'smtlib' as text parsed at once
+        self.backend = backend
+        # Seed every descent check with the assignment of the previous model
+        self.phase_hints = phase_hints
+        # Cube-and-conquer on the courier of the cubes heaviest items (0 disables it)
+        self.cubes = cubes
+        # Processes of the cubes and of the portfolio variants
+        self.workers = workers or os.cpu_count() or 1
 
+    def bound_guard(self, solver, encoding, bound):
+        # Each probed bound is enabled through its own guard literal, so a failed
+        # probe is dropped from the assumptions instead of being popped off the stack
+        guards = encoding['guards']
+        if bound not in guards:
+            guards[bound] = Bool(f'bound_{bound}')
+            solver.add(Implies(guards[bound], encoding['bound_constraint'](bound)))
+        return guards[bound]
 
-    def solve_mcp_nosym(self, m, n, l, s, D, timeout = 300):
-        start = time.time()
-        iter = 0
-        satisfiable = True
-        best_value = 0
-        best_solution = {}
+    def hint_phases(self, solver, encoding, tours):
+        # Initial values of the route literals for the next checks. Literals of the previous
+        # hint that are not in this one are set back to False, the others keep their value
+        literals = {literal.get_id(): literal for literal in encoding['hint_literals'](tours)}
+        for literal_id, literal in encoding.get('hinted', {}).items():
+            if literal_id not in literals:
+                solver.set_initial_value(literal, False)
+        for literal in literals.values():
+            solver.set_initial_value(literal, True)
+        encoding['hinted'] = literals
+
+    def next_probe(self, low, high, step):
+        # low is the smallest value not yet refuted, high the best value found so far
+        if self.search == 'binary':
+            return (low + high) // 2
+        if self.search in ('hybrid', 'core'):
+            # Galloping descent: the step doubles after every sat probe and is reset
+            # after an unsat one, so refuting probes stay close to the incumbent
+            return max(low, high - step)
+        return high - 1
+
+    def raise_probe(self, low, high, upper, raise_step):
+        # Lower bound raising of the 'core' search: asks for a solution within raise_step
+        # of the refuted bound, never above the incumbent or the hard upper bound. The step
+        # doubles after every unsat probe, so a lower bound far below the optimum is raised
+        # in a logarithmic number of calls
+        return min(upper if high is None else high - 1, low + raise_step - 1)
+
+    def minimize(self, solver, encoding, assumptions, start, deadline):
+        # encoding['objective'](model) is the max distance of a model and
+        # encoding['bound_constraint'](b) the formula stating that it is at most b.
+        # assumptions select the variant (e.g. symmetry breaking) and stay on every check.
+        # The search stops at the deadline, even in the middle of a check
+        if self.optimizer != 'descent':
+            return self.optimize(solver, encoding, assumptions, start, deadline)
+
+        best_solution = no_solution(0, encoding['x'])
+        probe_assumptions = []
+        low = encoding['lower_bound']
+        high = None
+        step = 0
+        # The 'core' search alternates lower bound raising probes with the descent, which
+        # checks without any bound while there is no incumbent, so that one is found early
+        raising = self.search == 'core'
+        raise_step = 1
+
+        # A heuristic solution is the incumbent until the solver finds a better one, and its
+        # literals are the initial phases of the search
+        if encoding.get('warm_start') is not None:
+            tours, high = encoding['warm_start']
+            best_solution = get_dict(int(time.time() - start), None, high, encoding['x'], False)
+            best_solution['tours'] = [[j+1 for j in tour] for tour in tours]
+            self.hint_phases(solver, encoding, tours)
+            if low < high:
+                probe = self.next_probe(low, high, 1)
+                probe_assumptions = [self.bound_guard(solver, encoding, probe)]
+        if raising and (high is None or low < high):
+            # Optimal in one call whenever the optimum is the lower bound
+            probe = self.raise_probe(low, high, encoding['upper_bound'], raise_step)
+            probe_assumptions = [self.bound_guard(solver, encoding, probe)]
+
+        while high is None or low < high:
+            if deadline.expired():
+                break
+            solver.set("timeout", int(deadline.remaining() * 1000))
+            with deadline.watchdog(solver.ctx):
+                status = solver.check(assumptions + probe_assumptions)
+            try_time = int(time.time() - start)
+
+            if status == sat:
+                model = encoding['convert_model'](solver.model())
+                high = encoding['objective'](model)
+                best_solution = get_dict(try_time, model, high, encoding['x'], False)
+                step = max(1, step * 2)
+                if self.phase_hints:
+                    # The next solution is usually close to this one
+                    self.hint_phases(solver, encoding, encoding['tours'](model))
+            elif status == unsat:
+                # The variant has no solution at all if no bound was probed, if the bound is
+                # the hard upper bound, or if the core leaves the bound out
+                core = solver.unsat_core() if probe_assumptions else []
+                infeasible = (not probe_assumptions or probe >= encoding['upper_bound'] or
+                              (len(core) > 0 and not any(literal.eq(probe_assumptions[0]) for literal in core)))
+                if infeasible and high is None:
+                    print("unsat")
+                    raise ValueError
+                low = probe + 1
+                if raising:
+                    raise_step *= 2
+                else:
+                    step = 1
+            else:
+                break
 
+            if self.search == 'core':
+                raising = not raising
+            if raising and (high is None or low < high):
+                probe = self.raise_probe(low, high, encoding['upper_bound'], raise_step)
+                probe_assumptions = [self.bound_guard(solver, encoding, probe)]
+            elif high is not None and low < high:
+                probe = self.next_probe(low, high, step)
+                probe_assumptions = [self.bound_guard(solver, encoding, probe)]
+            elif high is None:
+                # Descent side of the 'core' search before the first solution
+                probe_assumptions = []
 
-        solver = Solver()
-        solver.set("timeout", 300000)
+        if high is None:
+            best_solution['time'] = int(time.time() - start)
+        elif low >= high:
+            best_solution['optimal'] = True
+            best_solution['time'] = int(time.time() - start)
+        return best_solution
+
+    def optimize(self, solver, encoding, assumptions, start, deadline):
+        # The objective is handed to z3 Optimize instead of being descended by hand. With
+        # 'minimize' the integer max_distance is minimized directly. The MaxSAT engines run
+        # rounds with one soft constraint per bound among SOFT_BOUNDS points of the interval
+        # still open: bounds below the distance of the optimal model are refuted, which raises
+        # the lower bound, and the next round spreads its points below that distance.
+        # Bounds are reported as z3 finds them
+        best_solution = no_solution(0, encoding['x'])
+        low = encoding['lower_bound']
+
+        if encoding.get('warm_start') is not None:
+            tours, high = encoding['warm_start']
+            best_solution = get_dict(int(time.time() - start), None, high, encoding['x'], False)
+            best_solution['tours'] = [[j+1 for j in tour] for tour in tours]
+            for literal in encoding['hint_literals'](tours):
+                solver.set_initial_value(literal, True)
+
+        def on_model(model):
+            # z3 keeps updating the model it passes here after the callback returns, so the
+            # objective and the tours are read right away and the model is not kept
+            nonlocal best_solution
+            value = encoding['objective'](model)
+            if best_solution['distance'] is None or value < best_solution['distance']:
+                best_solution = get_dict(int(time.time() - start), None, value, encoding['x'], False)
+                best_solution['tours'] = [[j+1 for j in tour] for tour in encoding['tours'](model)]
+                print(f"{self.optimizer}: upper bound {value} after {time.time() - start:.2f}s")
+            return value
+        solver.set_on_model(on_model)
+
+        if self.optimizer == 'minimize' and 'max_distance' in encoding:
+            # The objective is registered once per formula, the runs on the same solver share it
+            if 'objective_handle' not in encoding:
+                encoding['objective_handle'] = solver.minimize(encoding['max_distance'])
+            status = unknown
+            if not deadline.expired():
+                solver.set("timeout", int(deadline.remaining() * 1000))
+                with deadline.watchdog(solver.ctx):
+                    status = solver.check(*assumptions)
+            if status == sat:
+                on_model(solver.model())
+                low = best_solution['distance']
+            elif status == unsat:
+                print("unsat")
+                raise ValueError
+            else:
+                # The bound proved so far, which is not a numeral while z3 has none (e.g. -oo)
+                proved = encoding['objective_handle'].lower()
+                low = max(low, proved.as_long()) if is_int_value(proved) else low
+        else:
+            # The arc model has no integer objective, so 'minimize' falls back to the
+            # default MaxSAT engine on the soft bounds
+            solver.set('maxsat_engine', OPTIMIZERS[self.optimizer])
+            while not deadline.expired():
+                # Values above the incumbent, or above the hard upper bound, need no soft bound
+                top = encoding['upper_bound'] if best_solution['distance'] is None else best_solution['distance'] - 1
+                if low > top:
+                    break
+                points = sorted({low + (top - low) * index // (SOFT_BOUNDS - 1) for index in range(SOFT_BOUNDS)})
+                solver.push()
+                for bound in points:
+                    solver.add_soft(encoding['bound_constraint'](bound), 1, 'max_distance')
+                solver.set("timeout", int(deadline.remaining() * 1000))
+                with deadline.watchdog(solver.ctx):
+                    status = solver.check(*assumptions)
+                value = on_model(solver.model()) if status == sat else None
+                solver.pop()
+
+                if status == unsat:
+                    print("unsat")
+                    raise ValueError
+                if status != sat:
+                    break
+                # The model violates the fewest soft bounds, so every bound below its distance is infeasible
+                low = max([low] + [bound + 1 for bound in points if bound < value])
+                print(f"{self.optimizer}: lower bound {low} after {time.time() - start:.2f}s")
+
+        if best_solution['distance'] is not None and low >= best_solution['distance']:
+            best_solution['optimal'] = True
+        print(f"{self.optimizer}: bounds [{low}, {best_solution['distance']}] after {time.time() - start:.2f}s")
+
+        best_solution['time'] = int(time.time() - start)
+        return best_solution
 
+    def symmetry_breaking(self, first_stop, l, s):
+        # first_stop[i] is the index of the first item delivered by courier i.
+        # Interchangeable couriers are ordered based on their first non-origin stop
+        return [first_stop[courier1] < first_stop[courier2] for courier1, courier2 in symmetric_pairs(l, s)]
+
+    def position_encoding(self, m, n, l, s, D):
         # Define variables
-        # x[i][j][k] is True if courier i visits point j as their k-th stop
-        x = [[[Bool(f'x_{i}_{j}_{k}') for k in range(n+2)] for j in range(n+1)] for i in range(m)] # n+1 or n+2 ?
+        # x[i][j][k] is True if courier i visits point j as their k-th stop, for k up to
+        # the courier's stop horizon plus the final return to the depot
+        # The fair division fixes the number of items of each courier (at least its count,
+        # and the counts add up to n), so that count is also the courier's stop horizon
+        horizons = fair_item_counts(m, n, l)
+        x = position_variables(m, n, horizons)
+        max_distance = Int('max_distance')
+
+        return {
+            "x": x,
+            "horizons": horizons,
+            "max_distance": max_distance,
+            "symmetry": Bool('symmetry_breaking'),
+            "lower_bound": calculate_lower_bound(D),
+            "upper_bound": calculate_upper_bound(D, n, m),
+            "objective": lambda model: model.eval(max_distance).as_long(),
+            "tours": lambda model: position_tours(model, m, n),
+            "bound_constraint": lambda bound: max_distance <= bound,
+            "hint_literals": lambda tours: [x[i][j][k+1] for i, tour in enumerate(tours) for k, j in enumerate(tour)] +
+                                           [x[i][n][k] for i, tour in enumerate(tours) for k in range(len(tour)+1, len(x[i][n]))],
+            "guards": {},
+            # Models of a preprocessed formula are mapped back to the variables of the encoding
+            "convert_model": lambda model: model
+        }
+
+    def build_position_model(self, solver, encoding, m, n, l, s, D, deadline):
+        exactly_one_enc = ENCODINGS[self.encoding]
+        x = encoding['x']
+        horizons = encoding['horizons']
 
         # Constraints
         # 1. Each courier starts and ends at the depot (point n+1)
         for i in range(m):
             solver.add(x[i][n][0])  # Start at depot
-            solver.add(x[i][n][n+1])  # End at depot
+            solver.add(x[i][n][horizons[i]+1])  # End at depot
         
         # 2. Each courier visits exactly one point at each step
-        for i in range(m):
-            for k in range(n+2):
-                solver.add(exactly_one([x[i][j][k] for j in range(n+1)], name=f"visit_e1_{i}_{k}"))
-        
         # 4. Each point (except depot) is visited exactly once by all couriers combined
-        for j in range(n):  # Exclude depot
-            solver.add(exactly_one([x[i][j][k] for i in range(m) for k in range(1,n+1)], name=f"point_e1_{j}"))
+        # This is the slowest part of the encoding, so the deadline is checked for every group
+        for group, name in position_groups(x, m, n):
+            deadline.check()
+            solver.add(exactly_one_enc(group, name=name))
         
         # 5. Respect load size for each courier
-        for i in range(m):
-            solver.add(Sum([If(x[i][j][k], s[j], 0) for j in range(n) for k in range(1,n+1)]) <= l[i])
+        _, loads = load_constraints([[[x[i][j][k] for k in range(1,horizons[i]+1)] for j in range(n)] for i in range(m)], m, n, l, s)
+        solver.add(loads)
 
         loads = list(enumerate(l))
         
@@ -128,7 +586,8 @@ class SAT_solver:
 
         # New constraint: Ensure consecutive stops
         for i in range(m):
-            for k in range(1,n+1):
+            deadline.check()
+            for k in range(1,horizons[i]+1):
                 for j in range(n):  # For each non-depot location
                     solver.add(Implies(
                         x[i][j][k],  # If courier i is at location j at step k
@@ -139,19 +598,28 @@ class SAT_solver:
                     ))
             
             # Ensure that after visiting depot, all remaining stops are also depot
-            for k in range(1,n+1):
+            for k in range(1,horizons[i]+1):
                 solver.add(Implies(
                     x[i][n][k],
-                    And([x[i][n][k2] for k2 in range(k+1, n+2)])
+                    And([x[i][n][k2] for k2 in range(k+1, horizons[i]+2)])
                 ))
 
+        # Symmetry breaking, only active when its guard literal is assumed
+        first_stop = [Sum([If(x[i][j][1], j, 0) for j in range(n)]) for i in range(m)]
+        solver.add(Implies(encoding['symmetry'], And(self.symmetry_breaking(first_stop, l, s))))
+
         # Calculate distances and set max_distance
-        max_distance = Int('max_distance')
+        max_distance = encoding['max_distance']
         courier_distances = []
         for i in range(m):
-            # Distance for the route
-            route_distance = Sum([If(And(x[i][j1][k], x[i][j2][k+1]), D[j1][j2], 0) 
-                                for j1 in range(n+1) for j2 in range(n+1) for k in range(n+1)])
+            # Distance for the route, summed per origin point: a whole route takes seconds
+            # to build on the larger instances, so the deadline is checked between points
+            partial_distances = []
+            for j1 in range(n+1):
+                deadline.check()
+                partial_distances.append(Sum([If(And(x[i][j1][k], x[i][j2][k+1]), D[j1][j2], 0)
+                                              for j2 in range(n+1) for k in range(horizons[i]+1)]))
+            route_distance = Sum(partial_distances)
             
             courier_distances.append(route_distance)
         
@@ -163,266 +631,426 @@ class SAT_solver:
 
         # set lower and upper bounds 
         solver.add(max_distance>=calculate_lower_bound(D))
-        solver.add(max_distance<=calculate_upper_bound(D, n, m))
-        
+        solver.add(max_distance<=encoding['upper_bound'])
 
-        while satisfiable:
-            status = solver.check()
-            try_time = int(time.time() - start)
-            
-            if status == unsat:
-                if iter == 0:
-                    print("unsat")
-                    raise ValueError
-                else:
-                    satisfiable = False
-            elif status == sat and timeout - try_time > 0:
-                iter += 1
-                model = solver.model()
-                best_value = model.eval(max_distance)
-                # print(iter)
-                # print(best_value)
-                best_solution = get_dict(try_time, model, best_value, x, False)
-                solver.push()
-                solver.add(max_distance < best_value)
-                solver.set("timeout", 300000-(try_time*1000))
-                # return model, max_distance, x
-            if timeout - try_time <= 0:
-                optimal = False
-                if iter == 0:
-                    raise TimeoutError
-                else:
-                    return best_solution     
-                
-        best_solution['optimal'] = True
-        return best_solution
+    def arc_encoding(self, m, n, D):
+        # Define variables
+        # y[i][j1][j2] is True if courier i travels from point j1 to point j2 (point n is the depot)
+        y = [[[Bool(f'y_{i}_{j1}_{j2}') if j1 != j2 else None for j2 in range(n+1)] for j1 in range(n+1)] for i in range(m)]
 
-    def solve_mcp_sym(self, m, n, l, s, D, timeout = 300):
-        start = time.time()
-        iter = 0
-        satisfiable = True
-        best_value = 0
-        best_solution = {}
+        # Distance of each courier is a pseudo-Boolean sum over its arcs
+        courier_arcs = [[(y[i][j1][j2], D[j1][j2]) for j1 in range(n+1) for j2 in range(n+1) if j1 != j2] for i in range(m)]
 
+        def bound_constraint(bound):
+            return And([PbLe(arcs, bound) for arcs in courier_arcs])
 
-        solver = Solver()
-        solver.set("timeout", 300000)
+        def objective(model):
+            tours = arc_tours(model, m, n)
+            return max(route_length([n] + tour + [n], D) for tour in tours)
 
-        # Define variables
-        # x[i][j][k] is True if courier i visits point j as their k-th stop
-        x = [[[Bool(f'x_{i}_{j}_{k}') for k in range(n+2)] for j in range(n+1)] for i in range(m)] # n+1 or n+2 ?
+        return {
+            "x": y,
+            "symmetry": Bool('symmetry_breaking'),
+            "lower_bound": calculate_lower_bound(D),
+            "upper_bound": calculate_upper_bound(D, n, m),
+            "objective": objective,
+            "tours": lambda model: arc_tours(model, m, n),
+            "bound_constraint": bound_constraint,
+            "hint_literals": lambda tours: [y[i][j1][j2] for i, tour in enumerate(tours) for j1, j2 in zip([n] + tour, tour + [n])],
+            "guards": {},
+            # Models of a preprocessed formula are mapped back to the variables of the encoding
+            "convert_model": lambda model: model
+        }
+
+    def build_arc_model(self, solver, encoding, m, n, l, s, D, deadline):
+        y = encoding['x']
+        out_arcs = [[[y[i][j][j2] for j2 in range(n+1) if j2 != j] for j in range(n+1)] for i in range(m)]
+        in_arcs = [[[y[i][j1][j] for j1 in range(n+1) if j1 != j] for j in range(n+1)] for i in range(m)]
+        # p[j] is the position of item j in its tour, wide enough that no cycle of items can wrap around
+        p = [BitVec(f'p_{j}', n.bit_length()) for j in range(n)]
 
         # Constraints
-        # 1. Each courier starts and ends at the depot (point n+1)
+        # Exactly-one groups here span m*n arcs, so they use native cardinality constraints
+        # instead of the pairwise encoding
+        # 1. Each courier leaves the depot once and comes back once
         for i in range(m):
-            solver.add(x[i][n][0])  # Start at depot
-            solver.add(x[i][n][n+1])  # End at depot
-        
-        # 2. Each courier visits exactly one point at each step
+            solver.add(exactly_one_pb(out_arcs[i][n]))
+            solver.add(exactly_one_pb(in_arcs[i][n]))
+
+        # 2. Each point (except depot) is left and entered exactly once by all couriers combined
+        for j in range(n):
+            deadline.check()
+            solver.add(exactly_one_pb([arc for i in range(m) for arc in out_arcs[i][j]]))
+            solver.add(exactly_one_pb([arc for i in range(m) for arc in in_arcs[i][j]]))
+
+        # 3. A courier that enters a point also leaves it
         for i in range(m):
-            for k in range(n+2):
-                solver.add(exactly_one([x[i][j][k] for j in range(n+1)], name=f"visit_e1_{i}_{k}"))
-        
-        # 4. Each point (except depot) is visited exactly once by all couriers combined
-        for j in range(n):  # Exclude depot
-            solver.add(exactly_one([x[i][j][k] for i in range(m) for k in range(1,n+1)], name=f"point_e1_{j}"))
-        
+            deadline.check()
+            for j in range(n):
+                solver.add(Or(in_arcs[i][j]) == Or(out_arcs[i][j]))
+
+        # 4. Tours start at the depot and positions increase along every arc, so no subtour
+        # can avoid the depot
+        for j2 in range(n):
+            deadline.check()
+            solver.add(Implies(Or([y[i][n][j2] for i in range(m)]), p[j2] == 1))
+            for j1 in range(n):
+                if j1 != j2:
+                    solver.add(Implies(Or([y[i][j1][j2] for i in range(m)]), p[j2] == p[j1] + 1))
+
         # 5. Respect load size for each courier
+        deadline.check()
+        a, loads = load_constraints([[out_arcs[i][j] for j in range(n)] for i in range(m)], m, n, l, s)
+        solver.add(loads)
+
+        # Fair division of loads, as in the position model
+        sorted_loads = [idx for idx, _ in sorted(enumerate(l), key=lambda x: x[1], reverse=True)]
         for i in range(m):
-            solver.add(Sum([If(x[i][j][k], s[j], 0) for j in range(n) for k in range(1,n+1)]) <= l[i])
+            solver.add(AtLeast(*a[i], n//m + (1 if i in sorted_loads[:n%m] else 0)))
 
-        loads = list(enumerate(l))
-        
-        # Sort the list of tuples based on the number (in descending order)
-        sorted_indexed_numbers = sorted(loads, key=lambda x: x[1], reverse=True)
-        
-        # Extract the sorted numbers and their original indices
-        sorted_loads = [idx for idx, _ in sorted_indexed_numbers]
+        # Symmetry breaking, only active when its guard literal is assumed
+        first_stop = [Sum([If(y[i][n][j], j, 0) for j in range(n)]) for i in range(m)]
+        solver.add(Implies(encoding['symmetry'], And(self.symmetry_breaking(first_stop, l, s))))
 
-        # Fair division of loads
-        for fair in range(1,(n//m)+1): 
-            for i in range(m):
-                solver.add(at_least_one([x[i][j][fair] for j in range(n)]))  # j from 0 to n (non-depot locations)
-        
-        if n%m != 0:
-            for i in range(n%m):
-                solver.add(at_least_one([x[sorted_loads[i]][j][fair+1] for j in range(n)]))  # j from 0 to n (non-depot locations)
+        # set upper bound
+        deadline.check()
+        solver.add(encoding['bound_constraint'](encoding['upper_bound']))
 
-        # New constraint: Ensure consecutive stops
-        for i in range(m):
-            for k in range(1,n+1):
-                for j in range(n):  # For each non-depot location
-                    solver.add(Implies(
-                        x[i][j][k],  # If courier i is at location j at step k
-                        Or(
-                            Or([x[i][j2][k+1] for j2 in range(n)]),  # Next step is another non-depot location
-                            x[i][n][k+1]  # Or next step is the depot
-                        )
-                    ))
-            
-            # Ensure that after visiting depot, all remaining stops are also depot
-            for k in range(1,n+1):
-                solver.add(Implies(
-                    x[i][n][k],
-                    And([x[i][n][k2] for k2 in range(k+1, n+2)])
-                ))
+    def build_model_text(self, solver, encoding, m, n, l, s, D, deadline):
+        # Same formula as build_position_model / build_arc_model, written as SMT-LIB2 text
+        # and parsed in a few large chunks. Exactly-one encodings with auxiliary variables are
+        # still added through the z3 API, they only account for a linear number of nodes
+        minimum = fair_item_counts(m, n, l)
+        pairs = symmetric_pairs(l, s)
+        if self.model == 'arc':
+            lines = smtlib.arc_model(m, n, l, s, D, minimum, pairs, encoding['upper_bound'], deadline)
+        else:
+            lines = smtlib.position_model(m, n, l, s, D, encoding['horizons'], minimum, pairs, self.encoding,
+                                          encoding['lower_bound'], encoding['upper_bound'], deadline)
+        smtlib.parse(solver, lines, deadline)
 
-        # Symmetry breaking for couriers with the same load capacity 
-        capacity_groups = defaultdict(list)
-        for i, capacity in enumerate(l):
-            capacity_groups[capacity].append(i)
-
-        for group in capacity_groups.values():
-            if len(group) > 1:
-                for i in range(len(group) - 1):
-                    courier1, courier2 = group[i], group[i+1]
-                    # Order based on the first non-origin stop
-                    solver.add(  
-                        Sum([If(x[courier1][j][1], j, 0) for j in range(n)]) < 
-                        Sum([If(x[courier2][j][1], j, 0) for j in range(n)])
-                    )
-        
-        # Symmetry breaking for couriers that can carry the same items (if total weight < load capacity of a courier)
-        weight_sum = sum(s)
-        sym_couriers = [index for index, value in enumerate(l) if value >= weight_sum]
-
-        for i in range(len(sym_couriers) - 1):
-            courier1, courier2 = sym_couriers[i], sym_couriers[i+1]
-            # Order based on the first non-origin stop
-            solver.add(
-                Sum([If(x[courier1][j][1], j, 0) for j in range(n)]) < 
-                Sum([If(x[courier2][j][1], j, 0) for j in range(n)])
-            )
+        if self.model == 'position' and self.encoding not in ('pairwise', 'native'):
+            exactly_one_enc = ENCODINGS[self.encoding]
+            for group, name in position_groups(encoding['x'], m, n):
+                solver.add(exactly_one_enc(group, name=name))
 
-        # Calculate distances and set max_distance
-        max_distance = Int('max_distance')
-        courier_distances = []
-        for i in range(m):
-            # Distance for the route
-            route_distance = Sum([If(And(x[i][j1][k], x[i][j2][k+1]), D[j1][j2], 0) 
-                                for j1 in range(n+1) for j2 in range(n+1) for k in range(n+1)])
-            
-            courier_distances.append(route_distance)
-        
-        for distance in courier_distances:
-            solver.add(max_distance >= distance)
+    def cache_path(self, m, n, l, s, D):
+        # The formula only depends on the instance content and on the model options
+        if self.cache_directory is None:
+            return None
+        key = json.dumps({"instance": [m, n, l, s, D], "model": self.model, "encoding": self.encoding}, sort_keys=True)
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.cache_directory, f"{digest}.smt2")
 
-        # Add a constraint to make max_distance as small as possible
-        solver.add(Or([max_distance == distance for distance in courier_distances]))
+    def empty_solver(self):
+        # Initial phases can only be set on the SMT core, which SimpleSolver exposes directly
+        if self.optimizer != 'descent':
+            return Optimize()
+        if self.warm_start or self.phase_hints:
+            return SimpleSolver()
+        return Solver()
 
-        # set lower and upper bounds 
-        solver.add(max_distance>=calculate_lower_bound(D))
-        solver.add(max_distance<=calculate_upper_bound(D, n, m))
-        
+    def build(self, m, n, l, s, D, deadline, warm_start=None):
+        solver = self.empty_solver()
+        if self.model == 'arc':
+            encoding = self.arc_encoding(m, n, D)
+        else:
+            encoding = self.position_encoding(m, n, l, s, D)
 
-        while satisfiable:
-            status = solver.check()
-            try_time = int(time.time() - start)
-            
-            if status == unsat:
-                if iter == 0:
-                    print("unsat")
-                    raise ValueError
+        # Variables are recreated by name, so a cached formula only needs to be parsed.
+        # The build steps check the deadline between z3 calls, and the watchdog interrupts
+        # the z3 calls that are still running when it expires
+        cache_file = self.cache_path(m, n, l, s, D)
+        with deadline.watchdog(solver.ctx):
+            try:
+                if cache_file is not None and os.path.exists(cache_file):
+                    solver.from_file(cache_file)
                 else:
-                    satisfiable = False
-            elif status == sat and timeout - try_time > 0:
-                iter += 1
-                model = solver.model()
-                best_value = model.eval(max_distance)
+                    if self.backend == 'smtlib':
+                        self.build_model_text(solver, encoding, m, n, l, s, D, deadline)
+                    elif self.model == 'arc':
+                        self.build_arc_model(solver, encoding, m, n, l, s, D, deadline)
+                    else:
+                        self.build_position_model(solver, encoding, m, n, l, s, D, deadline)
 
-                best_solution = get_dict(try_time, model, best_value, x, False)
-                solver.push()
-                solver.add(max_distance < best_value)
-                solver.set("timeout", 300000-(try_time*1000))
-            if timeout - try_time <= 0:
-                optimal = False
-                if iter == 0:
+                    if cache_file is not None:
+                        os.makedirs(self.cache_directory, exist_ok=True)
+                        with atomic_path(cache_file) as tmp_path, open(tmp_path, "w") as file:
+                            file.write(solver.sexpr())
+            except Z3Exception:
+                if deadline.expired():
                     raise TimeoutError
-                else:
-                    return best_solution     
-                
-        best_solution['optimal'] = True
-        return best_solution
-    
-    def solve_all(self):
-        names = ['1','2','3','4','5','6','7','8','9','10']
-        instances = ["01","02","03","04","05","06","07","08","09","10"]
-        for index, inst in enumerate(instances):
-            filename = os.path.join(os.getcwd(), "instances", f"inst{inst}.dat")
-            m, n, l, s, D = read_dat_file(filename)
+                raise
+        deadline.check()
 
-            out = self.solve_mcp_sym(m, n, l, s, D)
-            model = out['model']
-            x = out['x']
-            tours_sym = []
+        # z3 Optimize runs its own preprocessing, tactics only apply to the descent. The parent
+        # of the cubes only hands the formula to its workers, which do their own search
+        if TACTICS[self.tactic] is not None and self.optimizer == 'descent' and not self.cubes:
+            solver = self.tactic_solver(solver, encoding, deadline)
 
-            for i in range(m):
-                tour = [j+1 for k in range(n+2) for j in range(n+1) if model.eval(x[i][j][k]) and j != n]
-                tours_sym.append(tour)
+        encoding['warm_start'] = warm_start
+        return solver, encoding
 
-            out_nosym = self.solve_mcp_nosym(m, n, l, s, D)
-            model = out_nosym['model']
-            x = out_nosym['x']
-            tours_nosym = []
+    def greedy_solution(self, m, n, l, s, D):
+        # The greedy solution of --warm_start is computed before the encoding, so that it is
+        # still returned when the formula cannot be built within the deadline
+        return greedy_routing(m, n, l, s, D) if self.warm_start else None
 
-            for i in range(m):
-                tour = [j+1 for k in range(n+2) for j in range(n+1) if model.eval(x[i][j][k]) and j != n]
-                tours_nosym.append(tour)
-
-            out = {
-                "SAT":{
-                "time": int(out_nosym['time']),
-                "optimal": out_nosym['optimal'],
-                "obj": int(str(out_nosym['distance'])),
-                "sol": tours_nosym
-                },
-                "SAT_symbreak":{
-                "time": int(out['time']),
-                "optimal": out['optimal'],
-                "obj": int(str(out['distance'])),
-                "sol": tours_sym
-                }
-            }
+    def timeout_solution(self, warm_start, start):
+        # Result of a run whose formula could not be built in time: the greedy solution, if any
+        out = no_solution(min(int(time.time() - start), self.timelimit), None)
+        if warm_start is not None:
+            tours, out['distance'] = warm_start
+            out['tours'] = [[j+1 for j in tour] for tour in tours]
+        return out
 
-            with open(os.path.join(os.getcwd(), "res","SAT",f"{names[index]}.json"),"w") as file:
-                json.dump(out, file, indent = 4)
-    
-    def solve(self):
-        m, n, l, s, D = read_dat_file(self.file_path)
+    def tactic_solver(self, solver, encoding, deadline):
+        # The preprocessing runs once, and the descent then solves the preprocessed formula on an
+        # incremental solver, which keeps its learned clauses between the probes. The bound guards
+        # are added later over the variables of the encoding, which the preprocessing must keep;
+        # the variables it eliminates get their values back through the model converter
+        goal = Goal()
+        goal.add(solver.assertions())
+        start = time.time()
+        deadline.check()
+        try:
+            subgoals = TryFor(Then(*TACTICS[self.tactic]), max(1, int(deadline.remaining() * 1000)))(goal)
+        except Z3Exception as exception:
+            if deadline.expired():
+                raise TimeoutError
+            print(f"Tactic {self.tactic} does not apply to this formula ({exception}), using the default solver")
+            return solver
+        preprocessing_time = time.time() - start
+        num_exprs = lambda goal: Z3_goal_num_exprs(goal.ctx.ref(), goal.goal)
+        print(f"Tactic {self.tactic}: preprocessing took {preprocessing_time:.2f}s, "
+              f"{len(goal)} formulas ({num_exprs(goal)} nodes) -> "
+              f"{sum(len(subgoal) for subgoal in subgoals)} formulas ({sum(num_exprs(subgoal) for subgoal in subgoals)} nodes)")
+
+        kept = constant_names(subgoals[0]) if len(subgoals) == 1 else set()
+        needed = constant_names([encoding['bound_constraint'](encoding['upper_bound']), encoding['symmetry']])
+        if not needed <= kept:
+            print(f"Tactic {self.tactic} eliminates variables of the bound constraints, using the default solver")
+            return solver
+
+        preprocessed = self.empty_solver()
+        preprocessed.add(subgoals[0].as_expr())
+        encoding['convert_model'] = subgoals[0].convert_model
+        return preprocessed
+
+    def solve_mcp_nosym(self, m, n, l, s, D, deadline = None):
+        return self.solve_variant(m, n, l, s, D, False, deadline)
+
+    def solve_mcp_sym(self, m, n, l, s, D, deadline = None):
+        return self.solve_variant(m, n, l, s, D, True, deadline)
+
+    def solve_variant(self, m, n, l, s, D, symmetry_breaking, deadline = None):
+        deadline = deadline or Deadline(self.timelimit)
+        start = time.time()
+        warm_start = self.greedy_solution(m, n, l, s, D)
+        try:
+            solver, encoding = self.build(m, n, l, s, D, deadline, warm_start)
+        except TimeoutError:
+            return self.timeout_solution(warm_start, start)
+        symmetry = encoding['symmetry'] if symmetry_breaking else Not(encoding['symmetry'])
+        return self.minimize(solver, encoding, [symmetry], start, deadline)
+
+    def solve_variants(self, m, n, l, s, D, deadline = None):
+        # The base formula is encoded once: the two runs share the solver, and with it
+        # the clauses learned by the first one, and only differ by the symmetry guard.
+        # Each run is still charged with the encoding time. Both fit in the same deadline,
+        # the symmetry breaking run getting at most half of what is left after encoding
+        deadline = deadline or Deadline(self.timelimit)
+        start = time.time()
+        warm_start = self.greedy_solution(m, n, l, s, D)
+        try:
+            solver, encoding = self.build(m, n, l, s, D, deadline, warm_start)
+        except TimeoutError:
+            return self.timeout_solution(warm_start, start), self.timeout_solution(warm_start, start)
+        encoding_time = time.time() - start
+
+        out = self.minimize(solver, encoding, [encoding['symmetry']], start, deadline.split(0.5))
+        out_nosym = self.minimize(solver, encoding, [Not(encoding['symmetry'])], time.time() - encoding_time, deadline)
+        return out, out_nosym
+
+    def options(self):
+        # Constructor arguments of a solver with the same settings, for worker processes
+        return {
+            "instance_number": self.instance_number,
+            "timelimit": self.timelimit,
+            "save_directory": self.save_directory,
+            "search": self.search,
+            "model": self.model,
+            "encoding": self.encoding,
+            "cache_directory": self.cache_directory,
+            "tactic": self.tactic,
+            "warm_start": self.warm_start,
+            "optimizer": self.optimizer,
+            "backend": self.backend,
+            "phase_hints": self.phase_hints
+        }
+
+    def solve_portfolio(self, m, n, l, s, D, deadline = None):
+        # Every variant gets the same wall-clock deadline; the first one to prove
+        # optimality wins and the others are cancelled
+        deadline = deadline or Deadline(self.timelimit)
+        start = time.time()
+        options = self.options()
+        encodings = list(ENCODINGS) if self.model == 'position' else [self.encoding]
+        tasks = []
+        for encoding in encodings:
+            for symmetry_breaking in [True, False]:
+                name = encoding + ("_symbreak" if symmetry_breaking else "")
+                tasks.append((name, dict(options, encoding=encoding), symmetry_breaking, m, n, l, s, D, deadline))
+
+        variants = {}
+        processes = min(len(tasks), self.workers)
+        # spawn rather than fork, so that workers do not inherit the parent's z3 context
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            results = pool.imap_unordered(portfolio_worker, tasks)
+            for _ in tasks:
+                try:
+                    # Workers still encoding at the deadline cannot interrupt themselves
+                    name, result = results.next(timeout=deadline.remaining())
+                except multiprocessing.TimeoutError:
+                    break
+                result['wall_time'] = int(time.time() - start)
+                variants[name] = result
+                if result['optimal']:
+                    break
+            pool.terminate()
+
+        for task in tasks:
+            if task[0] not in variants:
+                variants[task[0]] = {"time": int(time.time() - start), "optimal": False, "obj": None, "sol": [], "cancelled": True}
+
+        solved = [name for name in variants if variants[name]['obj'] is not None]
+        if not solved:
+            # Variants still encoding at the deadline are terminated, the greedy solution is the answer
+            warm_start = self.greedy_solution(m, n, l, s, D)
+            obj, sol = (None, []) if warm_start is None else (warm_start[1], [[j+1 for j in tour] for tour in warm_start[0]])
+            return {"time": self.timelimit, "optimal": False, "obj": obj, "sol": sol, "winner": None,
+                    "variants": {name: {key: value for key, value in result.items() if key != 'sol'} for name, result in variants.items()}}
+        # Optimal variants first, then the smallest objective, then the earliest answer
+        winner = min(solved, key=lambda name: (not variants[name]['optimal'], variants[name]['obj'], variants[name]['wall_time']))
 
-        out = self.solve_mcp_sym(m, n, l, s, D)
+        return {
+            "time": variants[winner]['wall_time'] if variants[winner]['optimal'] else self.timelimit,
+            "optimal": variants[winner]['optimal'],
+            "obj": variants[winner]['obj'],
+            "sol": variants[winner]['sol'],
+            "winner": winner,
+            "variants": {name: {key: value for key, value in result.items() if key != 'sol'} for name, result in variants.items()}
+        }
+
+    def solve_cubes(self, m, n, l, s, D, deadline = None):
+        # Cube-and-conquer: the base formula is encoded once, then every cube fixes the
+        # courier of the heaviest items and is solved in a worker process. Workers share the
+        # best value through a multiprocessing Value, so a cube is closed as soon as it has
+        # nothing better than what any worker found. Optimal once every cube is closed
+        deadline = deadline or Deadline(self.timelimit)
+        start = time.time()
+        warm_start = self.greedy_solution(m, n, l, s, D)
+        best_obj, best_sol = None, []
+        if warm_start is not None:
+            tours, best_obj = warm_start
+            best_sol = [[j+1 for j in tour] for tour in tours]
+        try:
+            solver, encoding = self.build(m, n, l, s, D, deadline, warm_start)
+        except TimeoutError:
+            return {"time": self.timelimit, "optimal": False, "obj": best_obj, "sol": best_sol, "cubes": 0, "closed": 0}
+        cubes = heavy_item_cubes(m, n, l, s, self.cubes)
+
+        context = multiprocessing.get_context('spawn')
+        best = context.Value('i', best_obj if best_obj is not None else encoding['upper_bound'] + 1)
+        # Workers parse the formula instead of building it again, and run a plain descent
+        options = dict(self.options(), cache_directory=None, tactic='default', warm_start=False, backend='ast')
+        closed = 0
+        with context.Pool(min(self.workers, max(1, len(cubes))), initializer=cube_worker_init,
+                          initargs=(options, solver.sexpr(), best, m, n, l, s, D, deadline)) as pool:
+            results = pool.imap_unordered(cube_worker, cubes)
+            for _ in cubes:
+                try:
+                    found, cube_closed = results.next(timeout=deadline.remaining())
+                except multiprocessing.TimeoutError:
+                    break
+                closed += cube_closed
+                if found is not None and (best_obj is None or found[0] < best_obj):
+                    best_obj, best_sol = found
+            pool.terminate()
+
+        optimal = closed == len(cubes)
+        if optimal and best_obj is None:
+            print("unsat")
+            raise ValueError
+        return {
+            "time": int(time.time() - start) if optimal else self.timelimit,
+            "optimal": optimal,
+            "obj": best_obj,
+            "sol": best_sol,
+            "cubes": len(cubes),
+            "closed": closed
+        }
+
+    def extract_tours(self, out, m, n):
         model = out['model']
-        x = out['x']
-        tours_sym = []
+        if model is None:
+            # Warm start solution that the solver did not improve, or tours decoded with their model
+            return out['tours']
+        tours = arc_tours(model, m, n) if self.model == 'arc' else position_tours(model, m, n)
+        return [[j+1 for j in tour] for tour in tours]
 
-        for i in range(m):
-            tour = [j+1 for k in range(n+2) for j in range(n+1) if model.eval(x[i][j][k]) and j != n]
-            tours_sym.append(tour)
+    def get_results(self, m, n, l, s, D, deadline):
+        results = self.solve_results(m, n, l, s, D, deadline)
+        for name, result in results.items():
+            check_result(name, result, D)
+        return results
 
-        out_nosym = self.solve_mcp_nosym(m, n, l, s, D)
-        model = out_nosym['model']
-        x = out_nosym['x']
-        tours_nosym = []
+    def solve_results(self, m, n, l, s, D, deadline):
+        if self.portfolio:
+            return {"SAT_portfolio": self.solve_portfolio(m, n, l, s, D, deadline)}
+        if self.cubes:
+            return {"SAT_cubes": self.solve_cubes(m, n, l, s, D, deadline)}
 
-        for i in range(m):
-            tour = [j+1 for k in range(n+2) for j in range(n+1) if model.eval(x[i][j][k]) and j != n]
-            tours_nosym.append(tour)
+        out, out_nosym = self.solve_variants(m, n, l, s, D, deadline)
+        tours_sym = self.extract_tours(out, m, n)
+        tours_nosym = self.extract_tours(out_nosym, m, n)
 
-        out = {
+        # The last check may return a little after the deadline
+        return {
             "SAT":{
-            "time": int(out_nosym['time']),
+            "time": min(int(out_nosym['time']), self.timelimit),
             "optimal": out_nosym['optimal'],
-            "obj": int(str(out_nosym['distance'])),
+            "obj": out_nosym['distance'],
             "sol": tours_nosym
             },
             "SAT_symbreak":{
-            "time": int(out['time']),
+            "time": min(int(out['time']), self.timelimit),
             "optimal": out['optimal'],
-            "obj": int(str(out['distance'])),
+            "obj": out['distance'],
             "sol": tours_sym
             }
         }
 
+    def solve_all(self):
+        names = ['1','2','3','4','5','6','7','8','9','10']
+        instances = ["01","02","03","04","05","06","07","08","09","10"]
+        for index, inst in enumerate(instances):
+            filename = os.path.join(os.getcwd(), "instances", f"inst{inst}.dat")
+            deadline = Deadline(self.timelimit)
+            m, n, l, s, D = read_dat_file(filename)
+
+            out = self.get_results(m, n, l, s, D, deadline)
+
+            with open(os.path.join(os.getcwd(), "res","SAT",f"{names[index]}.json"),"w") as file:
+                json.dump(out, file, indent = 4)
+    
+    def solve(self):
+        # One deadline for the whole run, from reading the instance to writing the results
+        deadline = Deadline(self.timelimit)
+        m, n, l, s, D = read_dat_file(self.file_path)
+
+        out = self.get_results(m, n, l, s, D, deadline)
+
         with open(os.path.join(os.getcwd(), "res","SAT",f"{self.instance_number}.json"),"w") as file:
             json.dump(out, file, indent = 4)
 
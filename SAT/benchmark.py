@@ -0,0 +1,173 @@
+from z3 import *
+import argparse
+import time
+import json
+import os
+import multiprocessing
+import resource
+from SAT.SATclass import SAT_solver, ENCODINGS, OPTIMIZERS, read_dat_file, position_groups, position_variables, constant_names
+from SAT.heuristic import fair_item_counts
+from SAT.deadline import Deadline
+
+def instance_files(instance_numbers):
+    if instance_numbers:
+        return [os.path.join(os.getcwd(), "instances", f"inst{number:02d}.dat") for number in instance_numbers]
+    folder = os.path.join(os.getcwd(), "instances")
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith(".dat")]
+
+def encoding_size(encoding, m, n, l, s):
+    # Clauses and auxiliary variables produced by the exactly-one groups of the position
+    # model, once converted to CNF. Native cardinality constraints are kept as single
+    # pseudo-Boolean constraints by the conversion and are counted as such
+    x = position_variables(m, n, fair_item_counts(m, n, l))
+    goal = Goal()
+    for group, name in position_groups(x, m, n):
+        constraint = ENCODINGS[encoding](group, name=name)
+        goal.add(constraint)
+    cnf = Then('simplify', 'tseitin-cnf')(goal)[0]
+    variables = constant_names(cnf) - {str(literal) for courier in x for point in courier for literal in point}
+    return len(cnf), len(variables)
+
+def benchmark_encodings(instance_numbers, timelimit, output):
+    results = {}
+    print(f"{'instance':<10}{'encoding':<12}{'clauses':>10}{'aux vars':>10}{'build (s)':>11}{'solve (s)':>11}{'obj':>7}  optimal")
+    for file_path in instance_files(instance_numbers):
+        m, n, l, s, D = read_dat_file(file_path)
+        instance = os.path.basename(file_path).split('.')[0]
+        results[instance] = {}
+        for encoding in ENCODINGS:
+            clauses, aux_vars = encoding_size(encoding, m, n, l, s)
+
+            sat_solver = SAT_solver(instance_number=int(instance[4:]), timelimit=timelimit, encoding=encoding)
+            deadline = Deadline(timelimit)
+            start = time.time()
+            try:
+                solver, model = sat_solver.build(m, n, l, s, D, deadline)
+                build_time = time.time() - start
+                out = sat_solver.minimize(solver, model, [model['symmetry']], time.time(), deadline)
+                obj, optimal = out['distance'], out['optimal']
+            except TimeoutError:
+                build_time = time.time() - start
+                obj, optimal = None, False
+            solve_time = time.time() - start - build_time
+
+            results[instance][encoding] = {
+                "clauses": clauses,
+                "aux_vars": aux_vars,
+                "build_time": round(build_time, 3),
+                "solve_time": round(solve_time, 3),
+                "obj": obj,
+                "optimal": optimal
+            }
+            print(f"{instance:<10}{encoding:<12}{clauses:>10}{aux_vars:>10}{build_time:>11.2f}{solve_time:>11.2f}{str(obj):>7}  {optimal}")
+
+    if output:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, "w") as file:
+            json.dump(results, file, indent = 4)
+
+def benchmark_optimizers(instance_numbers, timelimit, model, output):
+    # The hand-rolled descent against each z3 Optimize mode, on the same formula and
+    # with symmetry breaking
+    results = {}
+    print(f"{'instance':<10}{'optimizer':<12}{'build (s)':>11}{'solve (s)':>11}{'obj':>7}  optimal")
+    for file_path in instance_files(instance_numbers):
+        m, n, l, s, D = read_dat_file(file_path)
+        instance = os.path.basename(file_path).split('.')[0]
+        results[instance] = {}
+        for optimizer in ['descent'] + list(OPTIMIZERS):
+            sat_solver = SAT_solver(instance_number=int(instance[4:]), timelimit=timelimit, model=model, encoding='native', optimizer=optimizer)
+            deadline = Deadline(timelimit)
+            start = time.time()
+            try:
+                solver, encoding = sat_solver.build(m, n, l, s, D, deadline)
+                build_time = time.time() - start
+                out = sat_solver.minimize(solver, encoding, [encoding['symmetry']], time.time(), deadline)
+                obj, optimal = out['distance'], out['optimal']
+            except TimeoutError:
+                build_time = time.time() - start
+                obj, optimal = None, False
+            solve_time = time.time() - start - build_time
+
+            results[instance][optimizer] = {
+                "build_time": round(build_time, 3),
+                "solve_time": round(solve_time, 3),
+                "obj": obj,
+                "optimal": optimal
+            }
+            print(f"{instance:<10}{optimizer:<12}{build_time:>11.2f}{solve_time:>11.2f}{str(obj):>7}  {optimal}")
+
+    if output:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, "w") as file:
+            json.dump(results, file, indent = 4)
+
+def build_measurement(task):
+    # Runs in a fresh process, so that the peak resident memory is the one of this build only
+    file_path, model, encoding, backend, timelimit = task
+    m, n, l, s, D = read_dat_file(file_path)
+    instance = os.path.basename(file_path).split('.')[0]
+    sat_solver = SAT_solver(instance_number=int(instance[4:]), timelimit=timelimit, model=model, encoding=encoding, backend=backend)
+    start = time.time()
+    try:
+        solver, _ = sat_solver.build(m, n, l, s, D, Deadline(timelimit))
+        assertions = len(solver.assertions())
+    except TimeoutError:
+        assertions = None
+    build_time = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    return build_time, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, assertions
+
+def benchmark_backends(instance_numbers, timelimit, model, encoding, output):
+    # Encoding time and peak memory of the z3 API construction against the SMT-LIB2 text one
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    print(f"{'instance':<10}{'backend':<10}{'build (s)':>11}{'peak (MB)':>11}{'assertions':>12}")
+    for file_path in instance_files(instance_numbers):
+        instance = os.path.basename(file_path).split('.')[0]
+        results[instance] = {}
+        for backend in ['ast', 'smtlib']:
+            with context.Pool(1) as pool:
+                build_time, peak, assertions = pool.apply(build_measurement, ((file_path, model, encoding, backend, timelimit),))
+            results[instance][backend] = {
+                "build_time": round(build_time, 3),
+                "peak_memory_mb": round(peak, 1),
+                "assertions": assertions
+            }
+            print(f"{instance:<10}{backend:<10}{build_time:>11.2f}{peak:>11.1f}{str(assertions):>12}")
+
+    if output:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, "w") as file:
+            json.dump(results, file, indent = 4)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the SAT model on the instances folder.")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    encodings = subparsers.add_parser('encodings', help='Size, build and solve time of each exactly-one encoding of the position model.')
+    encodings.add_argument('--instances', type=int, nargs='*', help='Instance numbers to run (default: every instance).')
+    encodings.add_argument('--timelimit', type=int, default=300, help='Time limit per encoding and instance in seconds (default: 300).')
+    encodings.add_argument('--output', default=None, help='Optional JSON file to save the measurements to.')
+
+    optimizers = subparsers.add_parser('optimizers', help='Solve time of the descent and of each z3 Optimize mode.')
+    optimizers.add_argument('--instances', type=int, nargs='*', help='Instance numbers to run (default: every instance).')
+    optimizers.add_argument('--timelimit', type=int, default=300, help='Time limit per optimizer and instance in seconds (default: 300).')
+    optimizers.add_argument('--model', choices=['position', 'arc'], default='position', help='SAT model to solve (default: position).')
+    optimizers.add_argument('--output', default=None, help='Optional JSON file to save the measurements to.')
+
+    backends = subparsers.add_parser('backends', help='Encoding time and peak memory of the z3 API and SMT-LIB2 text backends.')
+    backends.add_argument('--instances', type=int, nargs='*', help='Instance numbers to run (default: every instance).')
+    backends.add_argument('--timelimit', type=int, default=300, help='Time limit per build in seconds (default: 300).')
+    backends.add_argument('--model', choices=['position', 'arc'], default='position', help='SAT model to build (default: position).')
+    backends.add_argument('--encoding', choices=list(ENCODINGS), default='pairwise', help='Exactly-one encoding of the position model (default: pairwise).')
+    backends.add_argument('--output', default=None, help='Optional JSON file to save the measurements to.')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'encodings':
+        benchmark_encodings(args.instances, args.timelimit, args.output)
+    elif args.benchmark == 'optimizers':
+        benchmark_optimizers(args.instances, args.timelimit, args.model, args.output)
+    elif args.benchmark == 'backends':
+        benchmark_backends(args.instances, args.timelimit, args.model, args.encoding, args.output)
@@ -0,0 +1,46 @@
+import time
+import threading
+from contextlib import contextmanager
+from z3 import Solver
+
+class Deadline:
+    """
+    Wall-clock budget shared by every phase of a run (encoding, searches, extraction).
+    """
+    def __init__(self, seconds):
+        self.end = time.time() + seconds
+
+    def remaining(self):
+        return max(0.0, self.end - time.time())
+
+    def expired(self):
+        return time.time() >= self.end
+
+    def check(self):
+        # Called between encoding steps, since building the formula cannot be interrupted
+        if self.expired():
+            raise TimeoutError
+
+    def split(self, fraction):
+        # Sub-deadline ending after the given fraction of the remaining budget
+        return Deadline(self.remaining() * fraction)
+
+    @contextmanager
+    def watchdog(self, ctx):
+        # Interrupts z3 when the budget runs out, so that a running check() returns unknown
+        # and the incumbent can still be returned
+        fired = threading.Event()
+        def interrupt():
+            fired.set()
+            ctx.interrupt()
+        timer = threading.Timer(self.remaining(), interrupt)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+            # An interrupt that lands between two z3 calls stays pending on the context and would
+            # cancel the next tactic, e.g. of the next instance of solve_all. A check consumes it
+            if fired.is_set():
+                Solver(ctx=ctx).check()
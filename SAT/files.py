@@ -0,0 +1,14 @@
+import os
+from contextlib import contextmanager
+
+@contextmanager
+def atomic_path(path):
+    # Yields a temporary path to write the file to, which is then renamed to path. Runs sharing
+    # a cache directory therefore never read a partially written file
+    tmp_path = path + f".{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,78 @@
+import numpy as np
+from collections import defaultdict
+
+def symmetric_pairs(l, s):
+    # Pairs of interchangeable couriers, the first one of each pair delivering first: couriers with
+    # the same capacity, and couriers that can carry every item. Used by the symmetry breaking of
+    # both the SAT and the MIP models
+    pairs = []
+
+    # Symmetry breaking for couriers with the same load capacity
+    capacity_groups = defaultdict(list)
+    for i, capacity in enumerate(l):
+        capacity_groups[capacity].append(i)
+
+    for group in capacity_groups.values():
+        pairs += zip(group, group[1:])
+
+    # Symmetry breaking for couriers that can carry the same items (if total weight < load capacity of a courier)
+    weight_sum = sum(s)
+    sym_couriers = [index for index, value in enumerate(l) if value >= weight_sum]
+    pairs += zip(sym_couriers, sym_couriers[1:])
+
+    # A pair can come from both rules, and is only added once
+    return list(dict.fromkeys(pairs))
+
+def fair_item_counts(m, n, l):
+    # Number of items each courier delivers under the fair division of loads used by the
+    # models: n//m each, plus one for the n%m couriers with the largest capacity
+    sorted_loads = [idx for idx, _ in sorted(enumerate(l), key=lambda x: x[1], reverse=True)]
+    counts = [n//m] * m
+    for i in sorted_loads[:n%m]:
+        counts[i] += 1
+    return counts
+
+def greedy_assignment(m, n, l, s):
+    # Heaviest items first, each to the courier with the most residual capacity among
+    # those that still have a free slot. Returns None if some item does not fit
+    counts = np.array(fair_item_counts(m, n, l))
+    residual = np.array(l, dtype=int)
+    items = [[] for _ in range(m)]
+    for j in np.argsort(s, kind='stable')[::-1]:
+        candidates = np.flatnonzero((counts > 0) & (residual >= s[j]))
+        if len(candidates) == 0:
+            return None
+        i = candidates[np.argmax(residual[candidates])]
+        items[i].append(int(j))
+        residual[i] -= s[j]
+        counts[i] -= 1
+    return items
+
+def nearest_neighbour_tour(items, D):
+    # Start from the depot and always move to the closest item not yet delivered
+    depot = len(D) - 1
+    remaining = list(items)
+    tour = []
+    current = depot
+    while remaining:
+        nearest = int(np.argmin(D[current, remaining]))
+        current = remaining.pop(nearest)
+        tour.append(current)
+    return tour
+
+def tour_length(tour, D):
+    depot = len(D) - 1
+    route = [depot] + tour + [depot]
+    return int(sum(D[j1, j2] for j1, j2 in zip(route, route[1:])))
+
+def greedy_routing(m, n, l, s, D):
+    """
+    Capacity-feasible assignment followed by nearest-neighbour routing.
+    :return: (tours, objective) with 0-based items, or None if the greedy assignment fails.
+    """
+    D = np.array(D)
+    items = greedy_assignment(m, n, l, s)
+    if items is None:
+        return None
+    tours = [nearest_neighbour_tour(courier_items, D) for courier_items in items]
+    return tours, max(tour_length(tour, D) for tour in tours)
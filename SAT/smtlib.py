@@ -0,0 +1,189 @@
+# SMT-LIB2 text writers for the SAT models. They produce the same formulas as the
+# build_*_model methods of SAT_solver, with the same variable names, but as plain
+# strings that z3 parses in a few from_string calls instead of one Python call
+# per AST node
+
+# Characters of text parsed by each from_string call. The parser cannot be interrupted,
+# so the deadline is only checked between chunks (about a second each)
+CHUNK_SIZE = 8 * 1024 * 1024
+
+def check(deadline):
+    # The writers run for seconds on the large instances, the deadline is checked between their steps
+    if deadline is not None:
+        deadline.check()
+
+def parse(solver, lines, deadline):
+    # Declarations and definitions stay visible to the later chunks, so the lines can be
+    # parsed in pieces as long as no command is split
+    chunk, size = [], 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            deadline.check()
+            solver.from_string("\n".join(chunk))
+            chunk, size = [], 0
+    if chunk:
+        deadline.check()
+        solver.from_string("\n".join(chunk))
+
+def declare(names, sort='Bool'):
+    return [f"(declare-fun {name} () {sort})" for name in names]
+
+def disjunction(literals):
+    if len(literals) == 1:
+        return literals[0]
+    return f"(or {' '.join(literals)})" if literals else "false"
+
+def pb_eq(literals, bound):
+    return f"((_ pbeq {bound} {' '.join('1' for _ in literals)}) {' '.join(literals)})"
+
+def pb_le(weighted, bound):
+    # weighted is a list of (literal, weight)
+    return f"((_ pble {bound} {' '.join(str(weight) for _, weight in weighted)}) {' '.join(literal for literal, _ in weighted)})"
+
+def at_least(literals, bound):
+    return f"((_ at-least {bound}) {' '.join(literals)})"
+
+def exactly_one(literals, encoding):
+    # Only the encodings without auxiliary variables are written as text
+    if encoding == 'native':
+        return [f"(assert {pb_eq(literals, 1)})"]
+    return [f"(assert {disjunction(literals)})"] + [f"(assert (or (not {a}) (not {b})))" for idx, a in enumerate(literals) for b in literals[idx+1:]]
+
+def weighted_sum(terms):
+    # terms is a list of (condition, value), conditions with a zero value are dropped
+    terms = [f"(ite {condition} {value} 0)" for condition, value in terms if value != 0]
+    if not terms:
+        return "0"
+    return terms[0] if len(terms) == 1 else f"(+ {' '.join(terms)})"
+
+def loads(carries, m, n, l, s):
+    # Text version of load_constraints, carries[i][j] being the literals of courier i carrying item j
+    lines = declare(f"a_{i}_{j}" for i in range(m) for j in range(n))
+    for i in range(m):
+        lines += [f"(assert (= a_{i}_{j} {disjunction(carries[i][j])}))" for j in range(n)]
+        lines.append(f"(assert {pb_le([(f'a_{i}_{j}', s[j]) for j in range(n)], l[i])})")
+    return lines
+
+def symmetry(first_stop, pairs):
+    constraints = [f"(< {first_stop[courier1]} {first_stop[courier2]})" for courier1, courier2 in pairs]
+    if not constraints:
+        return []
+    return [f"(assert (=> symmetry_breaking (and {' '.join(constraints)})))"]
+
+def position_model(m, n, l, s, D, horizons, minimum, pairs, encoding, lower_bound, upper_bound, deadline=None):
+    """
+    Position model of SAT_solver.build_position_model as SMT-LIB2 text.
+    :param horizons: stop horizon of each courier, its fair division item count.
+    :param minimum: fair division item count of each courier.
+    :param pairs: couriers ordered by the symmetry breaking constraints.
+    :param encoding: 'pairwise' or 'native', the other exactly-one groups are left to the caller.
+    :param deadline: Deadline checked between the steps, if any.
+    :return: the formula as a list of SMT-LIB2 commands, one per line.
+    """
+    x = lambda i, j, k: f"x_{i}_{j}_{k}"
+    lines = declare(x(i, j, k) for i in range(m) for j in range(n+1) for k in range(horizons[i]+2))
+    lines += declare(['symmetry_breaking'])
+    lines += declare(['max_distance'], 'Int')
+
+    # 1. Each courier starts and ends at the depot
+    for i in range(m):
+        lines.append(f"(assert {x(i, n, 0)})")
+        lines.append(f"(assert {x(i, n, horizons[i]+1)})")
+
+    # 2. Each courier visits exactly one point at each step
+    # 4. Each point (except depot) is visited exactly once by all couriers combined
+    if encoding in ('pairwise', 'native'):
+        for i in range(m):
+            check(deadline)
+            for k in range(horizons[i]+2):
+                lines += exactly_one([x(i, j, k) for j in range(n+1)], encoding)
+        for j in range(n):
+            check(deadline)
+            lines += exactly_one([x(i, j, k) for i in range(m) for k in range(1, horizons[i]+1)], encoding)
+
+    # 5. Respect load size for each courier
+    lines += loads([[[x(i, j, k) for k in range(1, horizons[i]+1)] for j in range(n)] for i in range(m)], m, n, l, s)
+
+    # Fair division of loads
+    for i in range(m):
+        for k in range(1, minimum[i]+1):
+            lines.append(f"(assert {disjunction([x(i, j, k) for j in range(n)])})")
+
+    # Consecutive stops, and only the depot once it has been reached
+    for i in range(m):
+        check(deadline)
+        for k in range(1, horizons[i]+1):
+            following = disjunction([x(i, j2, k+1) for j2 in range(n+1)])
+            lines += [f"(assert (=> {x(i, j, k)} {following}))" for j in range(n)]
+            lines.append(f"(assert (=> {x(i, n, k)} (and {' '.join(x(i, n, k2) for k2 in range(k+1, horizons[i]+2))})))")
+
+    # Symmetry breaking, only active when its guard literal is assumed
+    first_stop = [weighted_sum([(x(i, j, 1), j) for j in range(n)]) for i in range(m)]
+    lines += symmetry(first_stop, pairs)
+
+    # Distances and max_distance
+    for i in range(m):
+        check(deadline)
+        terms = [(f"(and {x(i, j1, k)} {x(i, j2, k+1)})", D[j1][j2]) for j1 in range(n+1) for j2 in range(n+1) for k in range(horizons[i]+1)]
+        lines.append(f"(define-fun distance_{i} () Int {weighted_sum(terms)})")
+        lines.append(f"(assert (>= max_distance distance_{i}))")
+    lines.append(f"(assert {disjunction([f'(= max_distance distance_{i})' for i in range(m)])})")
+
+    lines.append(f"(assert (>= max_distance {lower_bound}))")
+    lines.append(f"(assert (<= max_distance {upper_bound}))")
+    return lines
+
+def arc_model(m, n, l, s, D, minimum, pairs, upper_bound, deadline=None):
+    """
+    Arc model of SAT_solver.build_arc_model as SMT-LIB2 text.
+    :param minimum: fair division item count of each courier.
+    :param pairs: couriers ordered by the symmetry breaking constraints.
+    :param deadline: Deadline checked between the steps, if any.
+    :return: the formula as a list of SMT-LIB2 commands, one per line.
+    """
+    y = lambda i, j1, j2: f"y_{i}_{j1}_{j2}"
+    width = n.bit_length()
+    one = f"(_ bv1 {width})"
+    out_arcs = [[[y(i, j, j2) for j2 in range(n+1) if j2 != j] for j in range(n+1)] for i in range(m)]
+    in_arcs = [[[y(i, j1, j) for j1 in range(n+1) if j1 != j] for j in range(n+1)] for i in range(m)]
+    lines = declare(y(i, j1, j2) for i in range(m) for j1 in range(n+1) for j2 in range(n+1) if j1 != j2)
+    lines += declare(['symmetry_breaking'])
+    lines += declare((f"p_{j}" for j in range(n)), f"(_ BitVec {width})")
+
+    # 1. Each courier leaves the depot once and comes back once
+    for i in range(m):
+        lines.append(f"(assert {pb_eq(out_arcs[i][n], 1)})")
+        lines.append(f"(assert {pb_eq(in_arcs[i][n], 1)})")
+
+    # 2. Each point (except depot) is left and entered exactly once by all couriers combined
+    for j in range(n):
+        lines.append(f"(assert {pb_eq([arc for i in range(m) for arc in out_arcs[i][j]], 1)})")
+        lines.append(f"(assert {pb_eq([arc for i in range(m) for arc in in_arcs[i][j]], 1)})")
+
+    # 3. A courier that enters a point also leaves it
+    for i in range(m):
+        lines += [f"(assert (= {disjunction(in_arcs[i][j])} {disjunction(out_arcs[i][j])}))" for j in range(n)]
+
+    # 4. Positions increase along every arc, starting from 1 after the depot
+    for j2 in range(n):
+        check(deadline)
+        lines.append(f"(assert (=> {disjunction([y(i, n, j2) for i in range(m)])} (= p_{j2} {one})))")
+        lines += [f"(assert (=> {disjunction([y(i, j1, j2) for i in range(m)])} (= p_{j2} (bvadd p_{j1} {one}))))" for j1 in range(n) if j1 != j2]
+
+    # 5. Respect load size for each courier, with the fair division of loads
+    check(deadline)
+    lines += loads([[out_arcs[i][j] for j in range(n)] for i in range(m)], m, n, l, s)
+    lines += [f"(assert {at_least([f'a_{i}_{j}' for j in range(n)], minimum[i])})" for i in range(m)]
+
+    # Symmetry breaking, only active when its guard literal is assumed
+    first_stop = [weighted_sum([(y(i, n, j), j) for j in range(n)]) for i in range(m)]
+    lines += symmetry(first_stop, pairs)
+
+    # Upper bound on every courier distance
+    for i in range(m):
+        check(deadline)
+        arcs = [(y(i, j1, j2), D[j1][j2]) for j1 in range(n+1) for j2 in range(n+1) if j1 != j2]
+        lines.append(f"(assert {pb_le(arcs, upper_bound)})")
+    return lines
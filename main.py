@@ -1,5 +1,5 @@
 import argparse
-from MIP.MIPclass import MIP_solver  
+from MIP.MIPclass import MIP_solver, MIP_PRESETS  
 from SAT.SATclass import SAT_solver
 from CP.CSP_Model import CP_solver
 
@@ -50,9 +50,166 @@ def main():
     parser.add_argument(
         '--variation',
         type=int,
-        choices=[0, 1],
+        choices=[0, 1, 2],
         default=0,
-        help='The MTZ variation to use for MIP (default: 0). This is ignored if method is not MIP.'
+        help='The MTZ variation to use for MIP, 2 for subtour elimination cuts added lazily instead (default: 0). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--builder',
+        choices=['pulp', 'sparse'],
+        default='pulp',
+        help='How the MIP model is built: with PuLP expressions or as a NumPy constraint matrix written to MPS (default: pulp). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--preset',
+        choices=list(MIP_PRESETS),
+        default='default',
+        help='Preset of MIP solver parameters, overridden by the parameters given explicitly (default: default). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=None,
+        help='CBC threads of each MIP run (default: the cores split between the concurrent runs). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--cuts',
+        choices=['off', 'root', 'ifmove', 'on', 'forceOn'],
+        default=None,
+        help='CBC cut generator level, any level but off turns on all GLPK cuts (default: from the preset). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--presolve',
+        choices=['off', 'on', 'more'],
+        default=None,
+        help='CBC presolve, GLPK uses its MIP presolver unless off (default: from the preset). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--strong_branching',
+        type=int,
+        default=None,
+        help='Number of CBC strong branching candidates, GLPK uses pseudocost branching if positive (default: from the preset). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--fpump',
+        choices=['on', 'off'],
+        default=None,
+        help='Whether the MIP feasibility pump heuristic runs (default: from the preset). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--gap_rel',
+        type=float,
+        default=None,
+        help='Relative gap at which the MIP search stops, results are then not reported as optimal (default: from the preset). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--gap_abs',
+        type=float,
+        default=None,
+        help='Absolute gap at which CBC stops, results are then not reported as optimal (default: from the preset). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--neighbours',
+        type=int,
+        default=None,
+        help='Only create the MIP arcs between each node and its this many nearest nodes, results are then not reported as optimal (default: every capacity-feasible arc). This is ignored if method is not MIP.'
+    )
+
+    parser.add_argument(
+        '--symmetry_breaking',
+        action='store_true',
+        help='Order interchangeable MIP couriers by their first item. This is ignored if method is not MIP.'
+    )
+
+    # Arguments specific to SAT
+    parser.add_argument(
+        '--search',
+        choices=['linear', 'binary', 'hybrid', 'core'],
+        default='linear',
+        help='The descent strategy on the objective for SAT (default: linear). This is ignored if method is not SAT.'
+    )
+
+    parser.add_argument(
+        '--model',
+        choices=['position', 'arc'],
+        default='position',
+        help='The SAT model: position literals or successor arc literals (default: position). This is ignored if method is not SAT.'
+    )
+
+    parser.add_argument(
+        '--encoding',
+        choices=['pairwise', 'sequential', 'bitwise', 'heule', 'native'],
+        default='pairwise',
+        help='The exactly-one encoding of the SAT position model (default: pairwise). This is ignored if method is not SAT.'
+    )
+
+    parser.add_argument(
+        '--portfolio',
+        action='store_true',
+        help='Run every (encoding, symmetry breaking) SAT variant in parallel processes and keep the first optimal one. This is ignored if method is not SAT.'
+    )
+
+    parser.add_argument(
+        '--cache_directory',
+        default=None,
+        help='Directory where encoded SAT formulas and MIP models are cached and reused by later runs (default: no cache). This is ignored if method is CP.'
+    )
+
+    parser.add_argument(
+        '--tactic',
+        choices=['default', 'simplify'],
+        default='default',
+        help='The z3 tactic pipeline the SAT solver is built from (default: default). This is ignored if method is not SAT.'
+    )
+
+    parser.add_argument(
+        '--warm_start',
+        action='store_true',
+        help='Start the SAT descent or CBC from a greedy solution, used as initial upper bound and phase hint for SAT and as MIP start and cutoff for CBC. This is ignored if method is CP.'
+    )
+
+    parser.add_argument(
+        '--optimizer',
+        choices=['descent', 'minimize', 'maxres', 'wmax', 'rc2'],
+        default='descent',
+        help='Hand-rolled descent or z3 Optimize mode used to minimize the SAT objective (default: descent). This is ignored if method is not SAT.'
+    )
+
+    parser.add_argument(
+        '--backend',
+        choices=['ast', 'smtlib'],
+        default='ast',
+        help='How the SAT formula is constructed: through the z3 Python API or as SMT-LIB2 text parsed at once (default: ast). This is ignored if method is not SAT.'
+    )
+
+    parser.add_argument(
+        '--phase_hints',
+        action='store_true',
+        help='Use the previous model of the SAT descent as initial phases of the next check. This is ignored if method is not SAT.'
+    )
+
+    parser.add_argument(
+        '--cubes',
+        type=int,
+        default=0,
+        help='Cube-and-conquer on the couriers of this many heaviest items, 0 disables it (default: 0). This is ignored if method is not SAT.'
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of processes solving the SAT cubes or portfolio variants, or of MIP solver and variation combinations run at the same time (default: number of cores). This is ignored if method is CP.'
     )
 
     args = parser.parse_args()
@@ -76,6 +233,18 @@ def main():
             instance_number=args.instance_number,
             timelimit=args.timelimit,
             save_directory=args.save_directory+'/SAT',
+            search=args.search,
+            model=args.model,
+            encoding=args.encoding,
+            portfolio=args.portfolio,
+            cache_directory=args.cache_directory,
+            tactic=args.tactic,
+            warm_start=args.warm_start,
+            optimizer=args.optimizer,
+            backend=args.backend,
+            phase_hints=args.phase_hints,
+            cubes=args.cubes,
+            workers=args.workers,
         )
         if args.instance_number == 0:
             solver.solve_all()
@@ -89,7 +258,21 @@ def main():
             save_directory=args.save_directory+'/MIP',
             verbosity=args.verbosity,
             solver_name=args.solver,
-            variation=args.variation
+            variation=args.variation,
+            builder=args.builder,
+            cache_directory=args.cache_directory,
+            workers=args.workers,
+            preset=args.preset,
+            threads=args.threads,
+            cuts=args.cuts,
+            presolve=args.presolve,
+            strong_branching=args.strong_branching,
+            fpump=None if args.fpump is None else args.fpump == 'on',
+            gap_rel=args.gap_rel,
+            gap_abs=args.gap_abs,
+            warm_start=args.warm_start,
+            neighbours=args.neighbours,
+            symmetry_breaking=args.symmetry_breaking
         )
         if args.instance_number == 0:
             solver.solve_all()